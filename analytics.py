@@ -0,0 +1,106 @@
+"""
+Métricas compartidas por las páginas y la narrativa automática.
+
+MetricsBundle parte de una sola agregación del resultado filtrado por
+(Periodo, Concepto Russildi, Proveedor), que sale del cubo o, con un rango
+de Monto parcial, de un único recorrido de las filas (ver query_monto). La
+serie mensual, los rankings por concepto y proveedor, las participaciones
+del top-k y la comparación de los últimos 3 meses se re-agregan de esa
+tabla pequeña, cada una la primera vez que se pide. El bundle se memoriza
+junto al DataFrame filtrado: las páginas que comparten filtros comparten
+las métricas.
+"""
+from functools import cached_property
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from cube import rollup
+from filter_engine import get_session_filter_cache
+from utils import period_labels, query_monto
+
+# Dimensiones de la agregación base (además de Periodo)
+RANKING_DIMENSIONS = ["Concepto Russildi", "Proveedor"]
+
+# Meses recientes que se comparan contra el resto del periodo
+RECENT_MONTHS = 3
+
+
+class MetricsBundle:
+    """Métricas de un resultado de apply_global_filters (se calculan bajo demanda)."""
+
+    def __init__(self, filtered: pd.DataFrame):
+        self.filtered = filtered
+
+    @cached_property
+    def base(self) -> pd.DataFrame:
+        """sum/count/min/max/mean por (Periodo, Concepto Russildi, Proveedor), con llaves nulas."""
+        return query_monto(self.filtered, by=["Periodo"] + RANKING_DIMENSIONS, dropna=False)
+
+    @cached_property
+    def monthly(self) -> pd.Series:
+        """Gasto por periodo aaaamm, en orden cronológico (solo meses con montos)."""
+        return rollup(self.base, "Periodo")["sum"].rename("Monto")
+
+    @property
+    def periods(self) -> list:
+        return self.monthly.index.tolist()
+
+    @cached_property
+    def labels(self) -> dict:
+        """Etiquetas de los periodos (ver period_labels)."""
+        return period_labels(self.periods)
+
+    @property
+    def year(self) -> Optional[int]:
+        """Año del periodo, o None si abarca varios años."""
+        years = {p // 100 for p in self.periods}
+        return years.pop() if len(years) == 1 else None
+
+    @cached_property
+    def total(self) -> float:
+        return float(self.monthly.sum())
+
+    def by(self, dimension: str) -> pd.DataFrame:
+        """sum/count/min/max/mean por concepto o proveedor, de mayor a menor gasto (sin llaves nulas)."""
+        return self._rankings[dimension]
+
+    def ranking(self, dimension: str) -> pd.Series:
+        """Gasto por concepto o proveedor, de mayor a menor."""
+        return self.by(dimension)["sum"].rename("Monto")
+
+    def top_share(self, dimension: str, k: int = 3) -> float:
+        """Porcentaje del gasto total que concentran los k principales (0 si no hay gasto)."""
+        return self.ranking(dimension).head(k).sum() / self.total * 100 if self.total != 0 else 0
+
+    @cached_property
+    def _rankings(self) -> dict:
+        return {
+            dimension: rollup(self.base, dimension).sort_values("sum", ascending=False)
+            for dimension in RANKING_DIMENSIONS
+        }
+
+    @cached_property
+    def recent(self) -> Optional[dict]:
+        """
+        Promedio mensual de los últimos RECENT_MONTHS meses contra el resto del
+        periodo: dict con 'meses', 'promedio', 'promedio_resto' y 'delta_pct'
+        (nan si el resto promedia 0). None si hay menos de RECENT_MONTHS + 1 meses.
+        """
+        if len(self.monthly) <= RECENT_MONTHS:
+            return None
+        ultimos = self.monthly.iloc[-RECENT_MONTHS:]
+        resto = self.monthly.iloc[:-RECENT_MONTHS]
+        promedio, promedio_resto = ultimos.mean(), resto.mean()
+        return {
+            "meses": ultimos.index.tolist(),
+            "promedio": promedio,
+            "promedio_resto": promedio_resto,
+            "delta_pct": (promedio / promedio_resto - 1) * 100 if promedio_resto != 0 else np.nan,
+        }
+
+
+def get_metrics(filtered: pd.DataFrame) -> MetricsBundle:
+    """Bundle de métricas de un resultado de apply_global_filters, memorizado junto a él."""
+    return get_session_filter_cache().derived(filtered, ("metrics",), lambda: MetricsBundle(filtered))
@@ -0,0 +1,276 @@
+"""
+Detección de anomalías en el gasto.
+
+- Pólizas atípicas: movimientos cuyo Monto supera k veces la mediana de su
+  concepto. Las medianas y las razones salen de una sola transformación
+  agrupada, sin copias por grupo.
+- Meses y series atípicas: puntaje robusto (z modificado, con mediana y MAD)
+  del gasto mensual total y de cada serie mensual por concepto y por
+  proveedor. Las series por concepto y proveedor viven en un AnomalyModel
+  por origen de datos. Al recargar el mismo origen con meses nuevos (los
+  meses anteriores sin cambios) solo se agregan las celdas de los periodos
+  nuevos, y solo las series que reciben meses recalculan su mediana y MAD;
+  las demás se reutilizan tal cual.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from cube import get_monto_cube
+from data_cache import MAX_SHARED_DATASETS
+
+# Multiplicador de la mediana por defecto para las pólizas atípicas
+OUTLIER_MULTIPLIER = 3.0
+
+
+def concept_outliers(df: pd.DataFrame, multiplier: float = OUTLIER_MULTIPLIER,
+                     group_column: str = "Concepto Russildi") -> pd.DataFrame:
+    """
+    Pólizas cuyo Monto supera `multiplier` veces la mediana de su grupo.
+
+    Los grupos con mediana <= 0 y las filas sin grupo no se evalúan.
+
+    Args:
+        df: Filas con Monto numérico (p. ej. clean_filtered(filtered, ["Monto"]))
+        multiplier: Veces la mediana a partir de las cuales una póliza es atípica
+        group_column: Columna de agrupación
+
+    Returns:
+        Filas atípicas con las columnas 'MedianaConcepto' y 'VecesMediana',
+        ordenadas por grupo y con índice reiniciado
+    """
+    montos = df["Monto"]
+    medianas = montos.groupby(df[group_column], observed=True).transform("median")
+    mask = ((medianas > 0) & (montos > multiplier * medianas)).to_numpy()
+    outliers = df[mask].assign(
+        MedianaConcepto=medianas[mask],
+        VecesMediana=montos[mask] / medianas[mask],
+    )
+    return outliers.sort_values(group_column, kind="stable").reset_index(drop=True)
+
+
+# Umbral del puntaje robusto (z modificado de Iglewicz y Hoaglin)
+ROBUST_THRESHOLD = 3.5
+
+# Meses con gasto necesarios para evaluar una serie
+MIN_SERIES_MONTHS = 4
+
+# Dimensiones con series mensuales en el modelo
+SERIES_DIMENSIONS = ["Concepto Russildi", "Proveedor"]
+
+# Constante del z modificado: 0.6745 * (x - mediana) / MAD
+_MAD_SCALE = 0.6745
+
+
+def robust_stats(values) -> tuple:
+    """(mediana, MAD) de los valores; (nan, nan) si no hay valores."""
+    values = np.asarray(values, dtype="float64")
+    if len(values) == 0:
+        return np.nan, np.nan
+    median = float(np.median(values))
+    return median, float(np.median(np.abs(values - median)))
+
+
+def robust_scores(values, median: float, mad: float) -> np.ndarray:
+    """Puntaje robusto de cada valor; nan si la MAD es 0 (serie sin dispersión)."""
+    values = np.asarray(values, dtype="float64")
+    if not mad > 0:
+        return np.full(len(values), np.nan)
+    return _MAD_SCALE * (values - median) / mad
+
+
+def robust_limits(median: float, mad: float, threshold: float = ROBUST_THRESHOLD) -> tuple:
+    """(límite bajo, límite alto) equivalentes a |puntaje| = threshold."""
+    spread = threshold * mad / _MAD_SCALE
+    return median - spread, median + spread
+
+
+def score_series(series: pd.Series, threshold: float = ROBUST_THRESHOLD) -> pd.DataFrame:
+    """
+    Puntaje robusto de una serie mensual (p. ej. el gasto por Periodo).
+
+    Returns:
+        DataFrame con el índice de la serie y columnas 'Monto', 'Puntaje' y
+        'Atipico' (|Puntaje| > threshold)
+    """
+    median, mad = robust_stats(series.to_numpy())
+    scores = robust_scores(series.to_numpy(), median, mad)
+    return pd.DataFrame({
+        "Monto": series.to_numpy(dtype="float64"),
+        "Puntaje": scores,
+        "Atipico": np.abs(np.nan_to_num(scores)) > threshold,
+    }, index=series.index)
+
+
+class SeriesStats:
+    """
+    Historial mensual de una serie (periodos aaaamm y montos) con su mediana
+    y MAD. Es inmutable: los modelos comparten las series que no cambian.
+    """
+
+    __slots__ = ("periods", "values", "median", "mad")
+
+    def __init__(self, periods: np.ndarray, values: np.ndarray):
+        self.periods = periods
+        self.values = values
+        self.median, self.mad = robust_stats(values)
+
+    def appended(self, periods: np.ndarray, values: np.ndarray) -> "SeriesStats":
+        """Serie nueva con los meses `periods` (posteriores al historial) agregados al final."""
+        return SeriesStats(np.concatenate((self.periods, periods)), np.concatenate((self.values, values)))
+
+
+def monthly_totals(cells: pd.DataFrame) -> dict:
+    """
+    Series mensuales por concepto y proveedor de celdas del cubo (todas o
+    las de algunos periodos): {(dimensión, valor): (periodos, montos)}.
+    Solo meses con gasto.
+    """
+    totals = {}
+    for dimension in SERIES_DIMENSIONS:
+        grouped = cells.groupby([dimension, "Periodo"], observed=True)["sum"].sum()
+        if grouped.empty:
+            continue
+        keys = grouped.index.get_level_values(0)
+        periods = grouped.index.get_level_values(1).to_numpy(dtype="int64")
+        values = grouped.to_numpy(dtype="float64")
+        codes = pd.factorize(keys)[0]
+        bounds = np.concatenate(([0], np.flatnonzero(np.diff(codes)) + 1, [len(codes)]))
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            totals[(dimension, keys[start])] = (periods[start:stop], values[start:stop])
+    return totals
+
+
+def period_history(cells: pd.DataFrame) -> pd.DataFrame:
+    """Suma y conteo de Monto por Periodo de las celdas del cubo (huella de los meses cargados)."""
+    return cells.groupby("Periodo")[["sum", "count"]].sum()
+
+
+class AnomalyModel:
+    """
+    Series mensuales por concepto y proveedor con estadísticas robustas.
+
+    updated() deriva el modelo de una versión nueva del mismo origen: si los
+    periodos ya cargados no cambiaron, solo se agregan las celdas de los
+    periodos nuevos y solo las series que las reciben se recalculan.
+    """
+
+    def __init__(self, series: dict = None, history: pd.DataFrame = None):
+        self.series = series or {}
+        self.history = history
+
+    @classmethod
+    def from_cube(cls, cube) -> "AnomalyModel":
+        """Modelo completo a partir del cubo de un dataset."""
+        series = {key: SeriesStats(periods, values) for key, (periods, values) in monthly_totals(cube.cells).items()}
+        return cls(series, period_history(cube.cells))
+
+    def updated(self, cube) -> "AnomalyModel":
+        """
+        Modelo para el cubo de una versión nueva del dataset.
+
+        Si los periodos hasta el último del modelo tienen la misma suma y
+        conteo, solo se pliegan las celdas de los periodos posteriores; si
+        no (meses corregidos o quitados), se reconstruye completo.
+        """
+        history = period_history(cube.cells)
+        if self.history is None or self.history.empty:
+            return AnomalyModel.from_cube(cube)
+        last = self.history.index.max()
+        if not history[history.index <= last].equals(self.history):
+            return AnomalyModel.from_cube(cube)
+
+        series = dict(self.series)
+        new_cells = cube.cells[cube.cells["Periodo"].to_numpy() > last]
+        for key, (periods, values) in monthly_totals(new_cells).items():
+            previous = series.get(key)
+            series[key] = SeriesStats(periods, values) if previous is None else previous.appended(periods, values)
+        return AnomalyModel(series, history)
+
+    def anomalies(self, dimension: str, period_start: int = None, period_end: int = None,
+                  values: list = None, threshold: float = ROBUST_THRESHOLD) -> pd.DataFrame:
+        """
+        Meses atípicos de las series de una dimensión.
+
+        Args:
+            dimension: "Concepto Russildi" o "Proveedor"
+            period_start, period_end: Rango de periodos aaaamm a reportar (inclusive)
+            values: Si se indica, solo las series de esos valores
+            threshold: Umbral de |puntaje|
+
+        Returns:
+            DataFrame con 'Serie', 'Periodo', 'Monto', 'Mediana' y 'Puntaje',
+            ordenado por |Puntaje| descendente. Las series con menos de
+            MIN_SERIES_MONTHS meses con gasto no se evalúan.
+        """
+        wanted = None if values is None else set(values)
+        frames = []
+        for (dim, value), stats in self.series.items():
+            if dim != dimension or len(stats.values) < MIN_SERIES_MONTHS:
+                continue
+            if wanted is not None and value not in wanted:
+                continue
+            scores = robust_scores(stats.values, stats.median, stats.mad)
+            mask = np.abs(np.nan_to_num(scores)) > threshold
+            if period_start is not None:
+                mask &= stats.periods >= period_start
+            if period_end is not None:
+                mask &= stats.periods <= period_end
+            if mask.any():
+                frames.append(pd.DataFrame({
+                    "Serie": value,
+                    "Periodo": stats.periods[mask],
+                    "Monto": stats.values[mask],
+                    "Mediana": stats.median,
+                    "Puntaje": scores[mask],
+                }))
+        if not frames:
+            return pd.DataFrame(columns=["Serie", "Periodo", "Monto", "Mediana", "Puntaje"])
+        result = pd.concat(frames, ignore_index=True)
+        return result.iloc[np.argsort(-np.abs(result["Puntaje"].to_numpy()), kind="stable")].reset_index(drop=True)
+
+
+class AnomalyModelCache:
+    """
+    Modelos de anomalías por origen de datos (URL o archivo).
+
+    Si el origen se recarga con contenido distinto, el modelo nuevo se
+    deriva del anterior (ver AnomalyModel.updated).
+    """
+
+    def __init__(self, max_entries: int = MAX_SHARED_DATASETS):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, df: pd.DataFrame, source: str = "") -> AnomalyModel:
+        """Modelo del dataset `df` cargado desde `source`."""
+        with self._lock:
+            entry = self._entries.get(source)
+            if entry is not None:
+                self._entries.move_to_end(source)
+                if entry[0] is df:
+                    return entry[1]
+
+        cube = get_monto_cube(df)
+        model = entry[1].updated(cube) if entry is not None else AnomalyModel.from_cube(cube)
+        with self._lock:
+            self._entries[source] = (df, model)
+            self._entries.move_to_end(source)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return model
+
+
+@st.cache_resource
+def get_anomaly_model_cache() -> AnomalyModelCache:
+    """Instancia única de la caché de modelos, compartida por todas las sesiones."""
+    return AnomalyModelCache()
+
+
+def get_anomaly_model(df: pd.DataFrame, source: str = "") -> AnomalyModel:
+    """Modelo de anomalías del dataset compartido (ver AnomalyModelCache)."""
+    return get_anomaly_model_cache().get(df, source)
@@ -1,8 +1,13 @@
 import streamlit as st
 import pandas as pd
-import requests
-import io
-from utils import load_data, load_data_from_url, format_millions
+
+# Copy-on-Write (por defecto desde pandas 3): los DataFrames derivados de un
+# dataset compartido nunca escriben sobre él. Se activa una vez, en el punto
+# de entrada, antes de importar los módulos que manejan los datos.
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+from utils import ingest_file, ingest_url, check_ingest_result, render_load_diagnostics, export_snapshot, dataset_memory_report, set_session_dataset, get_session_df, read_raw_rows, format_millions, MONTH_NAMES
 
 st.set_page_config(
     page_title="Urbanización La Querencia",
@@ -20,6 +25,99 @@ ya curado (donde tú llenas *Categoría* y *Concepto Russildi*).
 
 st.caption("💡 **Tip:** Sube el archivo de egresos o proporciona una URL. Usa las pestañas de arriba para explorar: Overview, Conceptos, Proveedores, Anomalías y Explorer.")
 
+
+def guardar_ingesta(result):
+    """Guarda en la sesión el resultado de una ingesta (un solo parse del archivo)."""
+    check_ingest_result(result)
+    render_load_diagnostics(result.diagnostico)
+    set_session_dataset(result)
+    st.session_state["load_diagnostico"] = result.diagnostico
+    # El reporte de memoria se calcula una vez por dataset, no en cada rerun
+    if st.session_state.get("memory_report_handle") != result.handle:
+        st.session_state["memory_report"] = dataset_memory_report(result.df)
+        st.session_state["memory_report_handle"] = result.handle
+    # La hoja original no se guarda: su resumen viene en el diagnóstico de carga
+    st.session_state["data_source"] = result.source
+    return result.df
+
+
+def mostrar_diagnostico_meses(df, origen=None, expanded=False):
+    """
+    Diagnóstico de movimientos por mes. Usa el resumen de la columna Mes
+    calculado en la ingesta; las filas originales solo se re-leen si el
+    usuario lo pide (origen: archivo subido o URL).
+    """
+    conteo_por_mes = df.groupby("MesNum").size()
+    meses_con_datos = {MONTH_NAMES.get(m, str(m)): int(conteo) for m, conteo in conteo_por_mes.items()}
+
+    with st.expander("📊 Diagnóstico: Movimientos por mes", expanded=expanded):
+        st.write("**Conteo de movimientos por mes (cargados exitosamente):**")
+        # Ordenar por número de mes
+        meses_ordenados = sorted(meses_con_datos.items(), key=lambda x: next((k for k, v in MONTH_NAMES.items() if v == x[0]), 999))
+        for mes_nombre, conteo in meses_ordenados:
+            st.write(f"- {mes_nombre}: {conteo} movimientos")
+        
+        # Análisis de meses faltantes
+        meses_esperados = set(MONTH_NAMES.values())
+        meses_encontrados = set(meses_con_datos.keys())
+        meses_faltantes = meses_esperados - meses_encontrados
+        
+        if not meses_faltantes:
+            return
+        st.warning(f"⚠️ **Meses no encontrados en los datos cargados:** {sorted(meses_faltantes)}")
+
+        # Resumen de la columna Mes del archivo original (calculado en la ingesta)
+        report = st.session_state.get("load_diagnostico")
+        if report is None or not report.conteo_mes_original:
+            return
+
+        st.write(f"**Valores únicos en columna 'Mes' del archivo original:** {[row['Mes'] for row in report.conteo_mes_original]}")
+        st.write("**Conteo en archivo original (antes de filtros):**")
+        for row in report.conteo_mes_original:
+            status = "✅" if row["MesNum"] is not None else "❌"
+            st.write(f"- {status} {row['Mes']}: {row['Registros']} registros → {row['MesNum'] if row['MesNum'] is not None else 'NO RECONOCIDO'}")
+
+        no_reconocidos = report.meses_no_reconocidos
+        if no_reconocidos and origen is not None:
+            if st.button("🔎 Ver filas originales con mes no reconocido"):
+                try:
+                    with st.spinner("Leyendo archivo original..."):
+                        st.dataframe(read_raw_rows(origen, meses=no_reconocidos), use_container_width=True)
+                except Exception as e:
+                    st.error(f"No se pudieron leer las filas originales: {e}")
+
+
+def mostrar_memoria():
+    """Reporte de memoria por columna del dataset cargado (calculado al ingresar los datos)."""
+    report = st.session_state.get("memory_report")
+    if report is None:
+        return
+    total_mb = report.loc["Total", "Memoria (MB)"]
+    with st.expander(f"🧠 Memoria del dataset: {total_mb:,.1f} MB", expanded=False):
+        st.dataframe(report, use_container_width=True)
+
+
+def mostrar_descarga_snapshot(df):
+    """Botones para descargar el dataset limpio como snapshot Parquet / Arrow."""
+    diagnostico = st.session_state.get("load_diagnostico")
+    st.caption("💾 Descarga el dataset ya procesado para volver a cargarlo al instante o compartirlo.")
+    col_snap1, col_snap2 = st.columns(2)
+    with col_snap1:
+        st.download_button(
+            "Descargar snapshot (Parquet)",
+            data=lambda: export_snapshot(df, diagnostico, fmt="parquet"),
+            file_name="urbanizacion_snapshot.parquet",
+            mime="application/vnd.apache.parquet",
+        )
+    with col_snap2:
+        st.download_button(
+            "Descargar snapshot (Arrow)",
+            data=lambda: export_snapshot(df, diagnostico, fmt="arrow"),
+            file_name="urbanizacion_snapshot.arrow",
+            mime="application/vnd.apache.arrow.file",
+        )
+
+
 # Intentar cargar automáticamente desde URL si está configurada
 auto_load_url = None
 try:
@@ -33,17 +131,10 @@ if not auto_load_url and "data_url" in st.session_state and st.session_state["da
     auto_load_url = st.session_state["data_url"]
 
 # Cargar automáticamente si hay URL y no hay datos cargados
-if (auto_load_url and ("df" not in st.session_state or st.session_state.get("df") is None)):
+if auto_load_url and get_session_df() is None:
     try:
         with st.spinner("🔄 Cargando datos automáticamente desde URL..."):
-            df = load_data_from_url(auto_load_url)
-            st.session_state["df"] = df
-            
-            # Guardar también el raw para diagnóstico
-            response = requests.get(auto_load_url, timeout=30)
-            response.raise_for_status()
-            df_raw = pd.read_excel(io.BytesIO(response.content), engine='openpyxl')
-            st.session_state["df_raw"] = df_raw
+            guardar_ingesta(ingest_url(auto_load_url))
             st.session_state["data_url"] = auto_load_url
             
             st.success("✅ Datos cargados automáticamente")
@@ -58,12 +149,12 @@ uploaded_file = None
 load_from_url = False
 
 with tab1:
-    uploaded_file = st.file_uploader("Sube el archivo de Urbanización (Excel)", type=["xlsx"])
+    uploaded_file = st.file_uploader("Sube el archivo de Urbanización (Excel)", type=["xlsx", "xls", "csv", "parquet", "arrow", "feather"])
 
 with tab2:
     with st.container():
         st.markdown("#### 📋 Carga desde URL")
-        st.caption("Puedes compartir un enlace a tu archivo Excel desde Google Drive, Google Sheets, Dropbox o cualquier servidor web.")
+        st.caption("Puedes compartir un enlace a tu archivo Excel (o a un snapshot Parquet/Arrow) desde Google Drive, Google Sheets, Dropbox o cualquier servidor web.")
         
         with st.expander("ℹ️ Instrucciones detalladas", expanded=False):
             st.markdown("""
@@ -107,14 +198,7 @@ with tab2:
 if load_from_url and data_url:
     try:
         with st.spinner("Cargando datos desde URL..."):
-            df = load_data_from_url(data_url)
-            st.session_state["df"] = df
-            
-            # Guardar también el raw para diagnóstico
-            response = requests.get(data_url, timeout=30)
-            response.raise_for_status()
-            df_raw = pd.read_excel(io.BytesIO(response.content), engine='openpyxl')
-            st.session_state["df_raw"] = df_raw
+            guardar_ingesta(ingest_url(data_url, refresh=True))
             st.session_state["data_url"] = data_url
             
             st.success("✅ Archivo cargado correctamente desde URL")
@@ -126,12 +210,7 @@ if load_from_url and data_url:
 # Procesar carga desde archivo
 if uploaded_file is not None:
     try:
-        # Guardar una copia del dataframe original para diagnóstico
-        df_raw = pd.read_excel(uploaded_file, engine='openpyxl')
-        st.session_state["df_raw"] = df_raw
-        
-        df = load_data(uploaded_file)
-        st.session_state["df"] = df
+        df = guardar_ingesta(ingest_file(uploaded_file))
 
         st.success("Archivo cargado correctamente ✅")
 
@@ -140,11 +219,6 @@ if uploaded_file is not None:
         years = sorted(df["Año"].dropna().unique())
         meses = sorted(df["MesNum"].dropna().unique())
         
-        # Diagnóstico: contar por mes
-        from utils import MONTH_NAMES
-        conteo_por_mes = df.groupby("MesNum").size()
-        meses_con_datos = {MONTH_NAMES.get(m, str(m)): int(conteo) for m, conteo in conteo_por_mes.items()}
-
         c1, c2, c3 = st.columns(3)
         with c1:
             st.metric("Total histórico en archivo", format_millions(total_monto))
@@ -153,42 +227,7 @@ if uploaded_file is not None:
         with c3:
             st.metric("Meses distintos", len(meses))
         
-        # Mostrar conteo por mes
-        with st.expander("📊 Diagnóstico: Movimientos por mes", expanded=True):
-            st.write("**Conteo de movimientos por mes (cargados exitosamente):**")
-            # Ordenar por número de mes
-            meses_ordenados = sorted(meses_con_datos.items(), key=lambda x: next((k for k, v in MONTH_NAMES.items() if v == x[0]), 999))
-            for mes_nombre, conteo in meses_ordenados:
-                st.write(f"- {mes_nombre}: {conteo} movimientos")
-            
-            # Análisis de meses faltantes
-            meses_esperados = set(MONTH_NAMES.values())
-            meses_encontrados = set(meses_con_datos.keys())
-            meses_faltantes = meses_esperados - meses_encontrados
-            
-            if meses_faltantes:
-                st.warning(f"⚠️ **Meses no encontrados en los datos cargados:** {sorted(meses_faltantes)}")
-                
-                # Analizar el archivo original para ver qué hay
-                if "df_raw" in st.session_state:
-                    df_raw = st.session_state["df_raw"]
-                    
-                    # Mostrar valores únicos en columna Mes del archivo original
-                    meses_raw = df_raw["Mes"].astype(str).str.strip().str.capitalize().unique()
-                    meses_raw_clean = sorted([m for m in meses_raw if m.lower() != 'nan'])
-                    st.write(f"**Valores únicos en columna 'Mes' del archivo original:** {meses_raw_clean}")
-                    
-                    # Contar registros por mes en el archivo original
-                    st.write("**Conteo en archivo original (antes de filtros):**")
-                    conteo_raw = df_raw["Mes"].astype(str).str.strip().str.capitalize().value_counts().sort_index()
-                    for mes_raw, count in conteo_raw.items():
-                        if mes_raw.lower() != 'nan':
-                            # Verificar si se mapeó correctamente
-                            from utils import MONTH_MAP
-                            mes_normalizado = mes_raw.strip().capitalize()
-                            mapeado = MONTH_MAP.get(mes_normalizado, "NO MAPEADO")
-                            status = "✅" if mapeado != "NO MAPEADO" else "❌"
-                            st.write(f"- {status} {mes_raw}: {count} registros → {mapeado if mapeado != 'NO MAPEADO' else 'NO RECONOCIDO'}")
+        mostrar_diagnostico_meses(df, origen=uploaded_file, expanded=True)
 
         with st.container():
             st.subheader("📊 Vista previa de datos")
@@ -197,6 +236,8 @@ if uploaded_file is not None:
                 df.head(20),
                 use_container_width=True,
             )
+            mostrar_descarga_snapshot(df)
+            mostrar_memoria()
         
         st.info(
             "💡 Puedes navegar a las otras páginas desde el menú lateral (multipage) o el menú superior dependiendo de tu configuración."
@@ -205,8 +246,8 @@ if uploaded_file is not None:
         st.error(f"Error al cargar el archivo: {e}")
 
 # Mostrar datos si ya están cargados (desde URL automática o previa)
-elif "df" in st.session_state and st.session_state.get("df") is not None:
-    df = st.session_state["df"]
+elif get_session_df() is not None:
+    df = get_session_df()
     
     # Mostrar indicador de que los datos están cargados
     if st.session_state.get("data_url"):
@@ -214,8 +255,7 @@ elif "df" in st.session_state and st.session_state.get("df") is not None:
         if st.button("🔄 Recargar datos"):
             try:
                 with st.spinner("Recargando..."):
-                    df = load_data_from_url(st.session_state["data_url"])
-                    st.session_state["df"] = df
+                    df = guardar_ingesta(ingest_url(st.session_state["data_url"], refresh=True))
                     st.rerun()
             except Exception as e:
                 st.error(f"Error al recargar: {e}")
@@ -225,11 +265,6 @@ elif "df" in st.session_state and st.session_state.get("df") is not None:
     years = sorted(df["Año"].dropna().unique())
     meses = sorted(df["MesNum"].dropna().unique())
     
-    # Diagnóstico: contar por mes
-    from utils import MONTH_NAMES
-    conteo_por_mes = df.groupby("MesNum").size()
-    meses_con_datos = {MONTH_NAMES.get(m, str(m)): int(conteo) for m, conteo in conteo_por_mes.items()}
-
     c1, c2, c3 = st.columns(3)
     with c1:
         st.metric("Total histórico en archivo", format_millions(total_monto))
@@ -238,42 +273,10 @@ elif "df" in st.session_state and st.session_state.get("df") is not None:
     with c3:
         st.metric("Meses distintos", len(meses))
     
-    # Mostrar conteo por mes
-    with st.expander("📊 Diagnóstico: Movimientos por mes", expanded=False):
-        st.write("**Conteo de movimientos por mes (cargados exitosamente):**")
-        # Ordenar por número de mes
-        meses_ordenados = sorted(meses_con_datos.items(), key=lambda x: next((k for k, v in MONTH_NAMES.items() if v == x[0]), 999))
-        for mes_nombre, conteo in meses_ordenados:
-            st.write(f"- {mes_nombre}: {conteo} movimientos")
-        
-        # Análisis de meses faltantes
-        meses_esperados = set(MONTH_NAMES.values())
-        meses_encontrados = set(meses_con_datos.keys())
-        meses_faltantes = meses_esperados - meses_encontrados
-        
-        if meses_faltantes:
-            st.warning(f"⚠️ **Meses no encontrados en los datos cargados:** {sorted(meses_faltantes)}")
-            
-            # Analizar el archivo original para ver qué hay
-            if "df_raw" in st.session_state:
-                df_raw = st.session_state["df_raw"]
-                
-                # Mostrar valores únicos en columna Mes del archivo original
-                meses_raw = df_raw["Mes"].astype(str).str.strip().str.capitalize().unique()
-                meses_raw_clean = sorted([m for m in meses_raw if m.lower() != 'nan'])
-                st.write(f"**Valores únicos en columna 'Mes' del archivo original:** {meses_raw_clean}")
-                
-                # Contar registros por mes en el archivo original
-                st.write("**Conteo en archivo original (antes de filtros):**")
-                conteo_raw = df_raw["Mes"].astype(str).str.strip().str.capitalize().value_counts().sort_index()
-                for mes_raw, count in conteo_raw.items():
-                    if mes_raw.lower() != 'nan':
-                        # Verificar si se mapeó correctamente
-                        from utils import MONTH_MAP
-                        mes_normalizado = mes_raw.strip().capitalize()
-                        mapeado = MONTH_MAP.get(mes_normalizado, "NO MAPEADO")
-                        status = "✅" if mapeado != "NO MAPEADO" else "❌"
-                        st.write(f"- {status} {mes_raw}: {count} registros → {mapeado if mapeado != 'NO MAPEADO' else 'NO RECONOCIDO'}")
+    # Origen del dataset cargado (no el último data_url): un archivo subido
+    # ya no está disponible en este rerun, solo una URL se puede re-leer
+    origen = st.session_state.get("data_source") or ""
+    mostrar_diagnostico_meses(df, origen=origen if origen.startswith(("http://", "https://")) else None)
 
     with st.container():
         st.subheader("📊 Vista previa de datos")
@@ -282,6 +285,8 @@ elif "df" in st.session_state and st.session_state.get("df") is not None:
             df.head(20),
             use_container_width=True,
         )
+        mostrar_descarga_snapshot(df)
+        mostrar_memoria()
     
     st.info(
         "💡 Puedes navegar a las otras páginas desde el menú lateral (multipage) o el menú superior dependiendo de tu configuración."
@@ -0,0 +1,129 @@
+"""
+Cubo pre-agregado de Monto para KPIs y gráficos.
+
+Al cargar un dataset se agregan sus filas una sola vez por
+(Año, MesNum, Concepto Russildi, Categoría, Proveedor) con la suma, el
+conteo, el mínimo y el máximo de Monto. Mientras el filtro de Monto esté en
+su rango completo, los filtros globales solo seleccionan celdas del cubo y
+las consultas cuestan O(celdas) en lugar de O(filas). Con un rango de Monto
+parcial se vuelve a agregar sobre las filas filtradas.
+"""
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from filter_engine import DatasetIndexCache, GlobalFilters
+
+CUBE_DIMENSIONS = ["Año", "MesNum", "Concepto Russildi", "Categoría", "Proveedor"]
+MEASURES = ["sum", "count", "min", "max"]
+
+
+def aggregate_rows(df: pd.DataFrame, by=None, dropna: bool = True):
+    """
+    Agrega Monto de un conjunto de filas (solo montos no nulos).
+
+    Args:
+        df: Filas a agregar
+        by: Columna o lista de columnas de agrupación; None para el total
+        dropna: False para conservar los grupos con llaves nulas
+
+    Returns:
+        Con by: DataFrame indexado por by con sum, count, min, max y mean
+        (solo grupos con montos; sin llaves nulas salvo con dropna=False).
+        Sin by: Serie con las mismas medidas.
+    """
+    rows = df[df["Monto"].notna()]
+    if by is None:
+        montos = rows["Monto"]
+        return pd.Series({"sum": montos.sum(), "count": len(montos), "min": montos.min(),
+                          "max": montos.max(), "mean": montos.mean()})
+    grouped = rows.groupby(by, observed=True, dropna=dropna)["Monto"].agg(MEASURES)
+    grouped["count"] = grouped["count"].astype("int64")
+    grouped["mean"] = grouped["sum"] / grouped["count"]
+    return grouped
+
+
+def rollup(aggregates: pd.DataFrame, by, dropna: bool = True) -> pd.DataFrame:
+    """
+    Re-agrega medidas ya agregadas (sum, count, min, max) a menos dimensiones.
+
+    Args:
+        aggregates: Celdas del cubo o resultado de aggregate_rows / query
+        by: Columnas o niveles del índice por los que agrupar
+        dropna: False para conservar los grupos con llaves nulas
+
+    Returns:
+        DataFrame indexado por by con sum, count, min, max y mean
+    """
+    grouped = aggregates.groupby(by, observed=True, dropna=dropna).agg(
+        sum=("sum", "sum"), count=("count", "sum"), min=("min", "min"), max=("max", "max"),
+    )
+    grouped["count"] = grouped["count"].astype("int64")
+    grouped["mean"] = grouped["sum"] / grouped["count"]
+    return grouped
+
+
+class MontoCube:
+    """Celdas agregadas de Monto de un dataset (solo lectura)."""
+
+    def __init__(self, df: pd.DataFrame):
+        cells = (
+            df.groupby(CUBE_DIMENSIONS, observed=True, dropna=False)["Monto"]
+            .agg(MEASURES)
+            .reset_index()
+        )
+        # Las celdas sin montos no aportan a ninguna consulta
+        self.cells = cells[cells["count"] > 0].reset_index(drop=True)
+        # Llave de periodo aaaamm, para agrupar y filtrar rangos que cruzan de año
+        periods = (
+            self.cells["Año"].to_numpy(dtype="int64", na_value=-1) * 100
+            + self.cells["MesNum"].to_numpy(dtype="int64", na_value=-1)
+        )
+        self.cells["Periodo"] = periods
+        self._period = periods
+
+    def _cells_for(self, filters: GlobalFilters) -> pd.DataFrame:
+        mask = (self._period >= filters.period_start) & (self._period <= filters.period_end)
+        for column, values in filters.selections:
+            if values:
+                mask &= self.cells[column].isin(values).to_numpy()
+        return self.cells[mask]
+
+    def query(self, filters: GlobalFilters, by=None, dropna: bool = True):
+        """
+        Agrega las celdas seleccionadas por los filtros (ignora el rango de Monto).
+
+        Devuelve lo mismo que aggregate_rows sobre las filas filtradas.
+        """
+        cells = self._cells_for(filters)
+        if by is None:
+            total, count = cells["sum"].sum(), int(cells["count"].sum())
+            return pd.Series({"sum": total, "count": count, "min": cells["min"].min(),
+                              "max": cells["max"].max(), "mean": total / count if count else np.nan})
+        return rollup(cells, by, dropna=dropna)
+
+
+@st.cache_resource
+def get_cube_cache() -> DatasetIndexCache:
+    """Instancia única de la caché de cubos, compartida por todas las sesiones."""
+    return DatasetIndexCache(MontoCube)
+
+
+def get_monto_cube(df: pd.DataFrame) -> MontoCube:
+    """Cubo del DataFrame compartido (se construye una sola vez)."""
+    return get_cube_cache().get(df)
+
+
+def can_use_cube(filters: Optional[GlobalFilters]) -> bool:
+    """
+    True si los filtros se pueden responder desde el cubo: Monto en rango
+    completo, filtro por periodos (no por fechas) y fechas estimadas incluidas.
+    """
+    return (
+        filters is not None
+        and filters.full_monto_range
+        and filters.date_range is None
+        and filters.include_estimated
+    )
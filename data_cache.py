@@ -0,0 +1,295 @@
+"""
+Cachés a nivel de proceso para la carga de datos.
+
+- DatasetCache: caché direccionada por contenido para el dataset limpio. La
+  llave de cada entrada es el hash SHA-256 de los bytes del libro de Excel,
+  de modo que el mismo archivo (subido, recargado o descargado desde URL) se
+  resuelve sin volver a parsear ni normalizar. Las entradas viven en memoria
+  y en disco local, ambas con desalojo LRU acotado por tamaño.
+- DownloadCache: caché de bytes descargados por URL con revalidación
+  condicional (ETag / Last-Modified) y un TTL de frescura que evita la red.
+- DatasetRegistry: datasets vivos compartidos (solo lectura) por todas las
+  sesiones; cada sesión guarda solo un handle (origen, llave de contenido).
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+import streamlit as st
+
+# Incrementar cuando cambie el esquema o la lógica de limpieza de load_data,
+# para que las entradas viejas en disco no se reutilicen.
+CACHE_VERSION = "8"
+
+CACHE_DIR = os.environ.get(
+    "LAQUERENCIA_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "datasets"),
+)
+MAX_MEMORY_BYTES = int(os.environ.get("LAQUERENCIA_CACHE_MEMORY_MB", "512")) * 1024 * 1024
+MAX_DISK_BYTES = int(os.environ.get("LAQUERENCIA_CACHE_DISK_MB", "2048")) * 1024 * 1024
+
+# Segundos durante los que una descarga se considera fresca y no se consulta la red
+DOWNLOAD_TTL_SECONDS = float(os.environ.get("LAQUERENCIA_DOWNLOAD_TTL_SECONDS", "300"))
+MAX_DOWNLOAD_BYTES = int(os.environ.get("LAQUERENCIA_DOWNLOAD_CACHE_MB", "256")) * 1024 * 1024
+
+# Datasets distintos que se mantienen vivos en el registro compartido
+MAX_SHARED_DATASETS = int(os.environ.get("LAQUERENCIA_MAX_SHARED_DATASETS", "8"))
+
+
+def content_hash(content: bytes) -> str:
+    """Devuelve el hash SHA-256 (hex) de los bytes del archivo."""
+    return hashlib.sha256(content).hexdigest()
+
+
+def frame_nbytes(df: pd.DataFrame) -> int:
+    """Estima el tamaño en memoria de un DataFrame (incluye strings)."""
+    try:
+        return int(df.memory_usage(deep=True).sum())
+    except Exception:
+        return 0
+
+
+class DatasetCache:
+    """
+    Caché de dos niveles (memoria + disco) para el resultado de load_data.
+
+    Cada entrada guarda la tupla (DataFrame limpio, diagnóstico). El nivel en
+    memoria es un OrderedDict acotado por bytes; el nivel en disco son archivos
+    pickle acotados por tamaño total, usando la fecha de modificación como
+    marca de último acceso.
+    """
+
+    def __init__(self, cache_dir: str = CACHE_DIR, max_memory_bytes: int = MAX_MEMORY_BYTES,
+                 max_disk_bytes: int = MAX_DISK_BYTES):
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+
+    def key_for(self, content: bytes) -> str:
+        """Construye la llave de caché para los bytes de un libro."""
+        return f"v{CACHE_VERSION}-{content_hash(content)}"
+
+    def _path_for(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    def get(self, key: str):
+        """Devuelve (df, diagnostico) o None si la llave no está en caché."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key][0]
+
+        path = self._path_for(key)
+        try:
+            with open(path, "rb") as fh:
+                entry = pickle.load(fh)
+            os.utime(path, None)  # Marcar como usado recientemente
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None
+
+        self._put_memory(key, entry)
+        return entry
+
+    def put(self, key: str, df: pd.DataFrame, diagnostico) -> None:
+        """Guarda (df, diagnostico) en memoria y en disco."""
+        entry = (df, diagnostico)
+        self._put_memory(key, entry)
+        self._put_disk(key, entry)
+
+    def _put_memory(self, key: str, entry) -> None:
+        size = frame_nbytes(entry[0])
+        if size > self.max_memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_bytes -= self._memory.pop(key)[1]
+            self._memory[key] = (entry, size)
+            self._memory_bytes += size
+            while self._memory_bytes > self.max_memory_bytes and self._memory:
+                _, (_, evicted_size) = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted_size
+
+    def _put_disk(self, key: str, entry) -> None:
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as fh:
+                pickle.dump(entry, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path_for(key))
+        except (OSError, pickle.PicklingError):
+            # La caché en disco es best-effort: si falla, seguimos solo con memoria
+            return
+        self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        try:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith(".pkl"):
+                    continue
+                path = os.path.join(self.cache_dir, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+        except OSError:
+            return
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+class DownloadCache:
+    """
+    Caché de descargas HTTP por URL con GET condicional.
+
+    Cada entrada guarda los bytes junto con los encabezados ETag y
+    Last-Modified de la respuesta. Dentro del TTL se devuelven los bytes sin
+    tocar la red; pasado el TTL se revalida con If-None-Match /
+    If-Modified-Since y un 304 reutiliza los bytes guardados.
+    """
+
+    def __init__(self, ttl_seconds: float = DOWNLOAD_TTL_SECONDS,
+                 max_bytes: int = MAX_DOWNLOAD_BYTES):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def fetch(self, url: str, timeout: float = 60, validate=None, force_revalidate: bool = False) -> bytes:
+        """
+        Devuelve los bytes de la URL, usando la caché cuando es posible.
+
+        Args:
+            url: URL de descarga directa
+            timeout: Timeout de la petición en segundos
+            validate: Función opcional que recibe la respuesta y lanza una
+                excepción si el contenido no es válido (no se guarda en caché)
+            force_revalidate: Si True, ignora el TTL y revalida con el servidor
+
+        Raises:
+            requests.exceptions.RequestException: Si falla la descarga
+        """
+        import requests
+
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                self._entries.move_to_end(url)
+
+        if entry is not None and not force_revalidate:
+            if time.monotonic() - entry["fetched_at"] < self.ttl_seconds:
+                return entry["content"]
+
+        headers = {}
+        if entry is not None:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = requests.get(url, headers=headers, timeout=timeout, allow_redirects=True)
+        if response.status_code == 304 and entry is not None:
+            with self._lock:
+                entry["fetched_at"] = time.monotonic()
+            return entry["content"]
+
+        response.raise_for_status()
+        if validate is not None:
+            validate(response)
+
+        self._store(url, {
+            "content": response.content,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "fetched_at": time.monotonic(),
+        })
+        return response.content
+
+    def _store(self, url: str, entry: dict) -> None:
+        size = len(entry["content"])
+        with self._lock:
+            previous = self._entries.pop(url, None)
+            if previous is not None:
+                self._total_bytes -= len(previous["content"])
+            if size > self.max_bytes:
+                return
+            self._entries[url] = entry
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= len(evicted["content"])
+
+
+class DatasetRegistry:
+    """
+    Registro de datasets compartidos por todas las sesiones del proceso.
+
+    Cada entrada se indexa por (origen, llave de contenido) y guarda el
+    DataFrame limpio y su diagnóstico. Las sesiones solo guardan el handle
+    y nunca deben modificar el DataFrame compartido. Si una entrada se
+    desaloja, se recupera desde la caché de datasets (memoria o disco) por
+    su llave de contenido.
+    """
+
+    def __init__(self, dataset_cache: DatasetCache, max_datasets: int = MAX_SHARED_DATASETS):
+        self.dataset_cache = dataset_cache
+        self.max_datasets = max_datasets
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def register(self, source: str, content_key: str, df: pd.DataFrame, diagnostico) -> tuple:
+        """Registra un dataset y devuelve su handle (origen, llave de contenido)."""
+        handle = (source, content_key)
+        with self._lock:
+            self._entries[handle] = (df, diagnostico)
+            self._entries.move_to_end(handle)
+            while len(self._entries) > self.max_datasets:
+                self._entries.popitem(last=False)
+        return handle
+
+    def get(self, handle: tuple):
+        """Devuelve (df, diagnostico) del handle, o None si ya no está disponible."""
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is not None:
+                self._entries.move_to_end(handle)
+                return entry
+
+        entry = self.dataset_cache.get(handle[1])
+        if entry is None:
+            return None
+        self.register(handle[0], handle[1], *entry)
+        return entry
+
+
+@st.cache_resource
+def get_dataset_registry() -> DatasetRegistry:
+    """Instancia única del registro de datasets compartidos."""
+    return DatasetRegistry(get_dataset_cache())
+
+
+@st.cache_resource
+def get_download_cache() -> DownloadCache:
+    """Instancia única de la caché de descargas, compartida por todas las sesiones."""
+    return DownloadCache()
+
+
+@st.cache_resource
+def get_dataset_cache() -> DatasetCache:
+    """Instancia única de la caché, compartida por todas las sesiones del proceso."""
+    return DatasetCache()
@@ -0,0 +1,150 @@
+"""
+Exportación de vistas filtradas (Explorer) a CSV, Parquet y Excel.
+
+Los archivos se escriben por bloques de EXPORT_CHUNK_ROWS filas: no se
+arma un texto de CSV por toda la vista ni una tabla Arrow completa, y el
+Excel se escribe con openpyxl en modo write-only (las filas se vuelcan a
+disco a medida que se agregan). El archivo resultante sí queda completo en
+memoria (write_export devuelve sus bytes). Las páginas pasan export_view
+como callable a st.download_button, de modo que el archivo solo se genera
+cuando el usuario lo pide; export_view memoriza los archivos por firma de
+la vista (filtros) y formato en una caché de Streamlit, compartida y segura
+entre hilos.
+"""
+import importlib.util
+import io
+import os
+import tempfile
+
+import pandas as pd
+import streamlit as st
+
+from readers import arrow_compatible
+
+EXPORT_CHUNK_ROWS = 50_000
+
+# Archivos exportados que se conservan (por firma de la vista y formato)
+EXPORT_CACHE_SIZE = 4
+
+# Filas de datos que caben en una hoja de Excel (más el encabezado)
+XLSX_MAX_ROWS = 1_048_575
+
+# Formato -> (etiqueta del botón, extensión, MIME)
+EXPORT_FORMATS = {
+    "csv": ("CSV", "csv", "text/csv"),
+    "parquet": ("Parquet", "parquet", "application/vnd.apache.parquet"),
+    "xlsx": ("Excel", "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+
+def available_formats(rows: int = 0) -> list:
+    """Formatos disponibles para exportar `rows` filas (Parquet requiere pyarrow)."""
+    formats = list(EXPORT_FORMATS)
+    if importlib.util.find_spec("pyarrow") is None:
+        formats.remove("parquet")
+    if rows > XLSX_MAX_ROWS:
+        formats.remove("xlsx")
+    return formats
+
+
+def _chunks(df: pd.DataFrame, chunk_rows: int):
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+def _write_csv(df: pd.DataFrame, sink, chunk_rows: int) -> None:
+    # utf-8-sig: Excel reconoce los acentos al abrir el CSV
+    text = io.TextIOWrapper(sink, encoding="utf-8-sig", newline="")
+    for i, chunk in enumerate(_chunks(df, chunk_rows)):
+        chunk.to_csv(text, index=False, header=i == 0)
+    if len(df) == 0:
+        df.to_csv(text, index=False)
+    text.flush()
+    text.detach()
+
+
+def _write_parquet(df: pd.DataFrame, sink, chunk_rows: int) -> None:
+    import pyarrow as pa
+    import pyarrow.parquet
+
+    df = arrow_compatible(df)
+    # Esquema de toda la vista, para que los bloques sin valores en una
+    # columna de texto no cambien su tipo
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    with pyarrow.parquet.ParquetWriter(sink, schema, compression="zstd") as writer:
+        for chunk in _chunks(df, chunk_rows):
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+
+def _write_xlsx(df: pd.DataFrame, sink, chunk_rows: int) -> None:
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Movimientos")
+    sheet.append(list(df.columns))
+    for chunk in _chunks(df, chunk_rows):
+        # Columnas como object (Timestamps y números de Python) con nulos como
+        # celdas vacías, convertidas por columna y no por celda
+        columns = []
+        for col in chunk.columns:
+            values = chunk[col].astype(object)
+            columns.append(values.where(values.notna(), None).to_numpy())
+        for row in zip(*columns):
+            sheet.append(row)
+    # write-only escribe las filas en un temporal; se copia al destino al guardar
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "export.xlsx")
+        workbook.save(path)
+        with open(path, "rb") as f:
+            while block := f.read(1 << 20):
+                sink.write(block)
+
+
+_WRITERS = {
+    "csv": _write_csv,
+    "parquet": _write_parquet,
+    "xlsx": _write_xlsx,
+}
+
+
+def write_export(df: pd.DataFrame, fmt: str = "csv", chunk_rows: int = EXPORT_CHUNK_ROWS) -> bytes:
+    """
+    Exporta un DataFrame por bloques de filas.
+
+    Args:
+        df: Filas a exportar (p. ej. la vista del Explorer)
+        fmt: "csv", "parquet" o "xlsx"
+        chunk_rows: Filas por bloque
+
+    Returns:
+        Bytes del archivo
+
+    Raises:
+        ValueError: Si el formato no está soportado
+    """
+    if fmt not in _WRITERS:
+        raise ValueError(f"Formato de exportación no soportado: {fmt}. Usa 'csv', 'parquet' o 'xlsx'")
+    sink = io.BytesIO()
+    _WRITERS[fmt](df, sink, chunk_rows)
+    return sink.getvalue()
+
+
+@st.cache_data(max_entries=EXPORT_CACHE_SIZE, show_spinner=False)
+def _cached_export(view_key: tuple, fmt: str, _df: pd.DataFrame) -> bytes:
+    # _df no se hashea: la vista queda identificada por view_key
+    return write_export(_df, fmt)
+
+
+def export_view(df: pd.DataFrame, fmt: str, view_key: tuple = None) -> bytes:
+    """
+    Exporta una vista, memorizando el archivo por (view_key, fmt).
+
+    Args:
+        df: Filas de la vista
+        fmt: "csv", "parquet" o "xlsx"
+        view_key: Firma de la vista (empieza con la identidad del dataset,
+            seguida de los filtros); None para no memorizar
+    """
+    if view_key is None:
+        return write_export(df, fmt)
+    return _cached_export(view_key, fmt, df)
@@ -0,0 +1,454 @@
+"""
+Motor de filtros indexado para los filtros globales (apply_global_filters).
+
+El índice se construye una vez por dataset, al cargarlo:
+- las filas se ordenan por (Año, MesNum), es decir, por la llave de periodo
+  aaaamm, de modo que un año, un rango de meses o cualquier rango de
+  periodos (aunque cruce de año) son un tramo contiguo que se resuelve con
+  búsqueda binaria;
+- Concepto Russildi, Categoría y Proveedor se guardan como arreglos de
+  códigos enteros (los códigos de la columna category), en el mismo orden;
+- dentro de cada (Año, MesNum) las filas quedan ordenadas por Monto, de
+  modo que un rango de Monto son sub-tramos que también se resuelven con
+  búsqueda binaria (los montos nulos quedan al final de cada bloque);
+- Fecha se guarda como int64 (ns) en su propio orden (argsort), de modo que
+  un rango de fechas, aunque cruce de año, se resuelve con búsqueda binaria
+  y luego se traduce al orden por (Año, MesNum) con el rango inverso;
+- los escalones del filtro de Monto (cuantiles y escala logarítmica
+  1-2-5) se calculan una sola vez.
+
+Cada filtro de valores se responde con una tabla booleana por código
+(lut[codes]), las máscaras se combinan con & y al final se toma una sola
+selección de filas del DataFrame, en su orden original.
+
+Además, cada sesión guarda en una LRU pequeña (FilterResultCache) los
+resultados ya resueltos: opciones de los filtros, el DataFrame filtrado y
+sus variantes limpias. Navegar entre páginas con los mismos filtros no
+recalcula nada.
+"""
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from data_cache import MAX_SHARED_DATASETS, frame_nbytes
+
+# DataFrames filtrados que se memorizan por sesión (las opciones de los
+# filtros, mucho más pequeñas, usan una caché aparte de OPTIONS_CACHE_SIZE)
+FILTER_CACHE_SIZE = int(os.environ.get("LAQUERENCIA_FILTER_CACHE_SIZE", "4"))
+# Tope en bytes por sesión, compartido por todas sus cachés de resultados
+# (resultados y variantes derivadas)
+FILTER_CACHE_MAX_BYTES = int(os.environ.get("LAQUERENCIA_FILTER_CACHE_MB", "256")) * 1024 * 1024
+OPTIONS_CACHE_SIZE = 128
+
+# Representación int64 de NaT
+NAT_INT64 = np.iinfo(np.int64).min
+
+# Cuantiles usados como escalones del filtro de Monto (cada 5 %)
+MONTO_QUANTILES = np.linspace(0, 1, 21)
+
+# Columnas de texto con filtro de valores (multiselect)
+DIMENSION_COLUMNS = ["Concepto Russildi", "Categoría", "Proveedor"]
+
+
+class FilterIndex:
+    """
+    Índice de filtros de un dataset (solo lectura).
+
+    Las posiciones que reciben y devuelven los métodos son posiciones en el
+    orden del índice (por Año y MesNum); `rows` es siempre un slice de ese
+    orden y `mask` una máscara booleana opcional del tamaño del slice.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        años = df["Año"].to_numpy(dtype="int64", na_value=-1)
+        meses = df["MesNum"].to_numpy(dtype="int64", na_value=-1)
+        montos = df["Monto"].to_numpy(dtype="float64", na_value=np.nan)
+        self.order = np.lexsort((montos, meses, años))
+        self.year = años[self.order]
+        self.month = meses[self.order]
+        # Llave aaaamm, ordenada (los nulos quedan antes de los periodos válidos)
+        self.period = self.year * 100 + self.month
+        self.monto = montos[self.order]
+
+        # Inicio de cada bloque (Año, MesNum), más el final del arreglo
+        cambios = np.flatnonzero((np.diff(self.year) != 0) | (np.diff(self.month) != 0)) + 1
+        self.block_starts = np.concatenate(([0], cambios, [len(self.order)]))
+
+        # Posición de cada fila en el orden por (Año, MesNum, Monto)
+        self.rank = np.empty_like(self.order)
+        self.rank[self.order] = np.arange(len(self.order))
+
+        # Fechas como int64 ordenadas (NaT es el mínimo int64: queda al inicio)
+        fechas = df["Fecha"].to_numpy(dtype="datetime64[ns]").view("int64")
+        self.fecha_order = np.argsort(fechas, kind="stable")
+        self.fecha_sorted = fechas[self.fecha_order]
+        self.fecha_valid_from = int(np.searchsorted(self.fecha_sorted, NAT_INT64, "right"))
+
+        if "FechaEstimada" in df.columns:
+            self.estimated = df["FechaEstimada"].to_numpy(dtype=bool, na_value=False)[self.order]
+        else:
+            self.estimated = np.zeros(len(self.order), dtype=bool)
+        self.has_estimated = bool(self.estimated.any())
+
+        self.codes = {}
+        self.labels = {}
+        for col in DIMENSION_COLUMNS:
+            values = df[col]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                codes, labels = values.cat.codes.to_numpy(), values.cat.categories
+            else:
+                codes, labels = pd.factorize(values)
+            self.codes[col] = codes[self.order]
+            self.labels[col] = pd.Index(labels)
+
+    def years(self) -> list:
+        """Años presentes en el dataset, ordenados."""
+        return [int(a) for a in np.unique(self.year) if a >= 0]
+
+    def year_rows(self, year: int) -> slice:
+        """Tramo de filas de un año."""
+        return slice(int(np.searchsorted(self.year, year, "left")),
+                     int(np.searchsorted(self.year, year, "right")))
+
+    def months(self, rows: slice) -> list:
+        """Meses presentes en el tramo, ordenados."""
+        return [int(m) for m in np.unique(self.month[rows]) if m >= 0]
+
+    def periods(self) -> list:
+        """Periodos aaaamm presentes en el dataset, ordenados."""
+        valid = (self.year >= 0) & (self.month >= 1)
+        return [int(p) for p in np.unique(self.period[valid])]
+
+    def period_rows(self, period_start: int, period_end: int) -> slice:
+        """Tramo de filas con periodo aaaamm entre period_start y period_end (inclusive)."""
+        return slice(int(np.searchsorted(self.period, period_start, "left")),
+                     int(np.searchsorted(self.period, period_end, "right")))
+
+    def date_bounds(self):
+        """(primera, última) fecha del dataset como datetime.date, o None si no hay fechas."""
+        if self.fecha_valid_from == len(self.fecha_sorted):
+            return None
+        first, last = self.fecha_sorted[self.fecha_valid_from], self.fecha_sorted[-1]
+        return pd.Timestamp(first).date(), pd.Timestamp(last).date()
+
+    def date_rows(self, start, end):
+        """
+        Filas con Fecha entre start y end (días completos, inclusive).
+
+        Returns:
+            (rows, mask): el tramo mínimo del orden por (Año, MesNum) que
+            contiene esas filas y la máscara que las marca (solo se recorren
+            las filas del rango, no la columna completa)
+        """
+        start_ns = pd.Timestamp(start).value
+        end_ns = (pd.Timestamp(end) + pd.Timedelta(days=1)).value
+        lo = max(int(np.searchsorted(self.fecha_sorted, start_ns, "left")), self.fecha_valid_from)
+        hi = int(np.searchsorted(self.fecha_sorted, end_ns, "left"))
+        if hi <= lo:
+            return slice(0, 0), None
+        positions = self.rank[self.fecha_order[lo:hi]]
+        first, last = int(positions.min()), int(positions.max()) + 1
+        mask = np.zeros(last - first, dtype=bool)
+        mask[positions - first] = True
+        return slice(first, last), mask
+
+    def estimated_mask(self, rows: slice) -> np.ndarray:
+        """Máscara del tramo con las filas cuya Fecha no es estimada."""
+        return ~self.estimated[rows]
+
+    def options(self, column: str, rows: slice, mask: Optional[np.ndarray] = None) -> list:
+        """Valores (sin nulos) de la columna presentes en la selección, ordenados."""
+        codes = self.codes[column][rows]
+        if mask is not None:
+            codes = codes[mask]
+        labels = self.labels[column]
+        present = np.bincount(codes[codes >= 0], minlength=len(labels)) > 0
+        return sorted(labels[present].tolist())
+
+    def isin(self, column: str, values: list, rows: slice) -> np.ndarray:
+        """Máscara del tramo con las filas cuyo valor está en `values`."""
+        labels = self.labels[column]
+        # La última posición de la tabla es para el código -1 (nulos): nunca coincide
+        lut = np.zeros(len(labels) + 1, dtype=bool)
+        positions = labels.get_indexer(values)
+        lut[positions[positions >= 0]] = True
+        return lut[self.codes[column][rows]]
+
+    def monto_bounds(self, rows: slice, mask: Optional[np.ndarray] = None):
+        """(mínimo, máximo) de Monto en la selección, o None si no hay montos."""
+        montos = self.monto[rows]
+        if mask is not None:
+            montos = montos[mask]
+        montos = montos[~np.isnan(montos)]
+        if len(montos) == 0:
+            return None
+        return float(montos.min()), float(montos.max())
+
+    def monto_mask(self, rows: slice, low: float, high: float) -> np.ndarray:
+        """Máscara del tramo con low <= Monto <= high (búsqueda binaria por bloque)."""
+        mask = np.zeros(rows.stop - rows.start, dtype=bool)
+        for start, stop in self._blocks(rows):
+            montos = self.monto[start:stop]
+            lo = start + int(np.searchsorted(montos, low, "left"))
+            hi = start + int(np.searchsorted(montos, high, "right"))
+            mask[lo - rows.start:hi - rows.start] = True
+        return mask
+
+    def monto_steps(self, rows: slice, mask: Optional[np.ndarray] = None) -> list:
+        """
+        Escalones del slider de Monto para la selección: los extremos
+        redondeados y los escalones (ver _monto_steps) de los montos
+        seleccionados, de modo que un rango estrecho conserva su propia
+        resolución.
+        """
+        montos = self.monto[rows]
+        if mask is not None:
+            montos = montos[mask]
+        montos = np.sort(montos[~np.isnan(montos)])
+        low, high = float(np.floor(montos[0])), float(np.ceil(montos[-1]))
+        steps = _monto_steps(montos)
+        inner = steps[(steps > low) & (steps < high)]
+        return [low] + inner.tolist() + [high]
+
+    def _blocks(self, rows: slice):
+        """(inicio, fin) de los bloques (Año, MesNum) contenidos en el tramo."""
+        starts = self.block_starts
+        first = int(np.searchsorted(starts, rows.start, "right")) - 1
+        last = int(np.searchsorted(starts, rows.stop, "left"))
+        for i in range(first, last):
+            start, stop = max(starts[i], rows.start), min(starts[i + 1], rows.stop)
+            if start < stop:
+                yield int(start), int(stop)
+
+    def take(self, rows: slice, mask: Optional[np.ndarray] = None) -> pd.DataFrame:
+        """Filas seleccionadas del DataFrame, en su orden original (una sola selección)."""
+        positions = self.order[rows]
+        if mask is not None:
+            positions = positions[mask]
+        return self.df.take(np.sort(positions))
+
+
+def _round_significant(values: np.ndarray, digits: int = 2) -> np.ndarray:
+    """Redondea a `digits` cifras significativas (para etiquetas legibles)."""
+    values = np.asarray(values, dtype="float64")
+    with np.errstate(divide="ignore"):
+        magnitude = np.floor(np.log10(np.abs(values)))
+    factor = np.where(np.isfinite(magnitude), 10 ** (digits - 1 - magnitude), 1.0)
+    return np.round(values * factor) / factor
+
+
+def _monto_steps(montos: np.ndarray) -> np.ndarray:
+    """
+    Escalones del filtro de Monto de una selección (montos ordenados, sin nulos):
+    cuantiles cada 5 % (histograma de igual frecuencia) más la escala
+    logarítmica 1-2-5 entre el mínimo y el máximo, con 2 cifras significativas
+    y en pesos enteros.
+    """
+    if len(montos) == 0:
+        return np.array([])
+    steps = [_round_significant(np.quantile(montos, MONTO_QUANTILES))]
+    largest = max(abs(montos[0]), abs(montos[-1]))
+    if largest > 0:
+        decades = 10.0 ** np.arange(0, np.ceil(np.log10(largest)) + 1)
+        log_steps = np.outer(decades, [1, 2, 5]).ravel()
+        steps += [log_steps, -log_steps, [0.0]]
+    steps = np.unique(np.round(np.concatenate(steps)))
+    return steps[(steps >= montos[0]) & (steps <= montos[-1])]
+
+
+class DatasetIndexCache:
+    """
+    Estructuras derivadas por dataset (índices, cubos), con desalojo LRU.
+
+    La llave es la identidad del DataFrame compartido; cada estructura se
+    construye con factory(df) y la entrada conserva una referencia al
+    DataFrame, de modo que la identidad no se reutiliza mientras exista.
+    """
+
+    def __init__(self, factory, max_entries: int = MAX_SHARED_DATASETS):
+        self.factory = factory
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, df: pd.DataFrame):
+        """Devuelve la estructura del DataFrame, construyéndola si no existe."""
+        key = id(df)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is df:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        value = self.factory(df)
+        with self._lock:
+            self._entries[key] = (df, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+
+@st.cache_resource
+def get_filter_index_cache() -> DatasetIndexCache:
+    """Instancia única de la caché de índices, compartida por todas las sesiones."""
+    return DatasetIndexCache(FilterIndex)
+
+
+def get_filter_index(df: pd.DataFrame) -> FilterIndex:
+    """Índice de filtros del DataFrame compartido (se construye una sola vez)."""
+    return get_filter_index_cache().get(df)
+
+
+@dataclass(frozen=True)
+class GlobalFilters:
+    """
+    Valores de los filtros globales resueltos en el rerun actual.
+
+    Attributes:
+        dataset: Handle del dataset (None si no es el dataset de la sesión)
+        period_start, period_end: Rango de periodos aaaamm (inclusive; None si
+            se filtra por rango de fechas)
+        selections: ((columna, valores), ...) por columna de DIMENSION_COLUMNS;
+            una tupla vacía de valores significa sin filtro
+        monto_range: (mínimo, máximo) de Monto, o None si no hay montos
+        full_monto_range: True si el rango de Monto no excluye ninguna fila
+        date_range: (inicio, fin) si se filtra por rango de fechas, o None
+        include_estimated: False si se excluyen las fechas estimadas (día 15)
+    """
+    dataset: Optional[tuple]
+    period_start: Optional[int]
+    period_end: Optional[int]
+    selections: tuple
+    monto_range: Optional[tuple]
+    full_monto_range: bool
+    date_range: Optional[tuple] = None
+    include_estimated: bool = True
+
+
+class CacheBudget:
+    """Tope de bytes compartido por las cachés de resultados de una sesión."""
+
+    def __init__(self, max_bytes: int = FILTER_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.caches = []
+
+
+class FilterResultCache:
+    """
+    LRU de resultados de filtros de una sesión, acotada en entradas y en bytes.
+
+    Las llaves son tuplas canónicas que empiezan con la identidad del
+    dataset (su handle en el registro compartido), seguidas de los valores
+    de los filtros. Las variantes derivadas de un resultado (ver derived) se
+    guardan junto a él, cuentan para su tamaño y se desalojan con él.
+
+    El tope de bytes (CacheBudget) es compartido por todas las cachés de la
+    sesión: al superarlo, la caché que crece desaloja primero sus propias
+    entradas más antiguas y luego las de las demás. Los resultados que por
+    sí solos superan el tope no se memorizan.
+    """
+
+    def __init__(self, max_entries: int = FILTER_CACHE_SIZE, budget: Optional[CacheBudget] = None):
+        self.max_entries = max_entries
+        self.budget = budget if budget is not None else CacheBudget()
+        self.budget.caches.append(self)
+        self._entries = OrderedDict()
+
+    def get_or_compute(self, key: Optional[tuple], compute):
+        """
+        Devuelve el resultado de la llave, calculándolo con compute() si no está.
+
+        Si key es None (dataset sin identidad conocida) no se memoriza.
+        """
+        if key is None:
+            return compute()
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+        value = compute()
+        size = _payload_nbytes(value)
+        if size > self.budget.max_bytes:
+            return value
+        self._entries[key] = [value, {}, size]
+        self.budget.total_bytes += size
+        self._evict()
+        return value
+
+    def derived(self, base, name: tuple, compute):
+        """
+        Variante memorizada de un resultado guardado en la caché (p. ej. el
+        DataFrame filtrado sin montos nulos). Si `base` no está en la caché,
+        o la variante no cabe en el tope de bytes, se calcula sin memorizar.
+        """
+        for entry in reversed(self._entries.values()):
+            if entry[0] is base:
+                variants = entry[1]
+                if name not in variants:
+                    value = compute()
+                    size = _payload_nbytes(value)
+                    if size > self.budget.max_bytes:
+                        return value
+                    variants[name] = value
+                    entry[2] += size
+                    self.budget.total_bytes += size
+                    self._evict()
+                return variants[name]
+        return compute()
+
+    def _pop_oldest(self) -> None:
+        _, (_, _, size) = self._entries.popitem(last=False)
+        self.budget.total_bytes -= size
+
+    def _evict(self) -> None:
+        budget = self.budget
+        # Siempre se conserva la entrada más reciente de esta caché
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_entries or budget.total_bytes > budget.max_bytes
+        ):
+            self._pop_oldest()
+        for other in budget.caches:
+            while other is not self and other._entries and budget.total_bytes > budget.max_bytes:
+                other._pop_oldest()
+
+
+def _payload_nbytes(value) -> int:
+    """
+    Tamaño en memoria de un resultado memorizado: DataFrames, arreglos y
+    tuplas o listas de ellos (p. ej. (rows, mask)); el resto cuenta 0.
+    """
+    if isinstance(value, pd.DataFrame):
+        return frame_nbytes(value)
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, (tuple, list)):
+        return sum(_payload_nbytes(item) for item in value)
+    return 0
+
+
+def get_session_filter_cache(name: str = "frames", max_entries: int = FILTER_CACHE_SIZE) -> FilterResultCache:
+    """
+    Caché de resultados de filtros de la sesión actual.
+
+    Todas las cachés de la sesión comparten un tope de FILTER_CACHE_MAX_BYTES
+    (ver CacheBudget).
+
+    Args:
+        name: Nombre de la caché; los DataFrames filtrados ("frames") se
+            guardan aparte de los resultados pequeños (opciones, rangos)
+        max_entries: Entradas máximas, al crear la caché
+    """
+    key = f"filter_cache_{name}"
+    if key not in st.session_state:
+        if "filter_cache_budget" not in st.session_state:
+            st.session_state["filter_cache_budget"] = CacheBudget()
+        st.session_state[key] = FilterResultCache(max_entries, st.session_state["filter_cache_budget"])
+    return st.session_state[key]
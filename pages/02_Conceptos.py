@@ -1,12 +1,11 @@
 import streamlit as st
-import pandas as pd
-from utils import ensure_data_loaded, apply_global_filters, format_millions, format_dataframe_currency
+from analytics import get_metrics
+from utils import ensure_data_loaded, apply_global_filters, clean_filtered, format_millions, currency_column_config
 
 st.set_page_config(layout="wide")
 
 def main():
-    ensure_data_loaded()
-    df = st.session_state["df"]
+    df = ensure_data_loaded()
 
     st.title("Conceptos – ¿En qué se está yendo el dinero?")
     st.caption("Análisis detallado del gasto por concepto de egreso")
@@ -16,24 +15,17 @@ def main():
         st.warning("No hay datos con los filtros seleccionados.")
         return
 
-    # Asegurar que Monto sea numérico
-    filtered_clean = filtered.copy()
-    filtered_clean["Monto"] = pd.to_numeric(filtered_clean["Monto"], errors="coerce")
-    filtered_clean = filtered_clean.dropna(subset=["Monto", "Concepto Russildi"])
+    # Agregado por Concepto Russildi (métricas compartidas; solo montos válidos)
+    metrics = get_metrics(filtered)
+    agg_concepto = metrics.by("Concepto Russildi")
     
-    if filtered_clean.empty:
+    if agg_concepto.empty:
         st.warning("No hay datos válidos con los filtros seleccionados.")
         return
     
-    # Agregado por Concepto Russildi
-    grp = (
-        filtered_clean.groupby("Concepto Russildi")["Monto"]
-        .sum()
-        .sort_values(ascending=False)
-    )
+    grp = metrics.ranking("Concepto Russildi")
 
     total = grp.sum()
-    top3 = grp.head(3).sum() if len(grp) >= 3 else grp.sum()
     top_concepto = grp.index[0]
     top_concepto_monto = grp.iloc[0]
     top_concepto_pct = top_concepto_monto / total * 100 if total != 0 else 0
@@ -46,7 +38,7 @@ def main():
     with c3:
         st.metric(
             "Top 3 concentran",
-            f"{top3 / total * 100:,.1f} %" if total != 0 else "0 %",
+            f"{metrics.top_share('Concepto Russildi', 3):,.1f} %" if total != 0 else "0 %",
         )
 
     st.subheader("📊 Top conceptos por gasto")
@@ -56,34 +48,20 @@ def main():
     # Tabla resumen
     st.subheader("Detalle por concepto")
 
-    # Agregar usando diccionario (sintaxis más compatible)
-    df_concept = filtered_clean.groupby("Concepto Russildi").agg({
-        "Monto": ["sum", "count", "mean"]
+    df_concept = agg_concepto[["sum", "count", "mean"]].rename(columns={
+        "sum": "Gasto_Total", "count": "Num_Polizas", "mean": "Ticket_Promedio",
     })
-    
-    # Aplanar MultiIndex de columnas
-    df_concept.columns = ["Gasto_Total", "Num_Polizas", "Ticket_Promedio"]
-    df_concept = df_concept.reset_index()
-    df_concept = df_concept.set_index("Concepto Russildi")
-    df_concept = df_concept.sort_values("Gasto_Total", ascending=False)
-    
+
     # Calcular porcentaje después de la agregación
     df_concept["Porcentaje"] = (df_concept["Gasto_Total"] / total * 100) if total != 0 else 0
     
-    # Formatear columnas de moneda
-    df_concept_display = df_concept.copy()
-    df_concept_display["Gasto_Total"] = df_concept_display["Gasto_Total"].apply(
-        lambda x: f"${x:,.2f}" if pd.notna(x) else "$0.00"
-    )
-    df_concept_display["Ticket_Promedio"] = df_concept_display["Ticket_Promedio"].apply(
-        lambda x: f"${x:,.2f}" if pd.notna(x) else "$0.00"
-    )
-    df_concept_display["Porcentaje"] = df_concept_display["Porcentaje"].apply(
-        lambda x: f"{x:,.2f}%" if pd.notna(x) else "0.00%"
+    # Moneda y porcentaje se formatean al mostrar; las columnas siguen numéricas
+    st.dataframe(
+        df_concept,
+        use_container_width=True,
+        column_config=currency_column_config(["Gasto_Total", "Ticket_Promedio"], percent_columns=["Porcentaje"]),
     )
 
-    st.dataframe(df_concept_display, use_container_width=True)
-
     # Drill-down: seleccionar un concepto
     st.subheader("🔍 Movimientos de un concepto específico")
     concepto_sel = st.selectbox(
@@ -92,6 +70,7 @@ def main():
         help="Selecciona un concepto para ver el detalle de todos sus movimientos"
     )
 
+    filtered_clean = clean_filtered(filtered, ["Monto", "Concepto Russildi"])
     df_detalle = filtered_clean[filtered_clean["Concepto Russildi"] == concepto_sel].copy()
     st.markdown(
         f"**{concepto_sel}** – {len(df_detalle)} movimientos, "
@@ -109,14 +88,9 @@ def main():
             "Categoría",
             "Concepto Russildi",
         ]
-    ].sort_values("Monto", ascending=False).copy()
-    
-    # Formatear columna Monto
-    df_detalle_display["Monto"] = df_detalle_display["Monto"].apply(
-        lambda x: f"${x:,.2f}" if pd.notna(x) else "$0.00"
-    )
-    
-    st.dataframe(df_detalle_display, use_container_width=True)
+    ].sort_values("Monto", ascending=False)
+
+    st.dataframe(df_detalle_display, use_container_width=True, column_config=currency_column_config(["Monto"]))
 
 
 main()
\ No newline at end of file
@@ -1,12 +1,11 @@
 import streamlit as st
-import pandas as pd
-from utils import ensure_data_loaded, apply_global_filters, format_millions, format_currency
+from analytics import get_metrics
+from utils import ensure_data_loaded, apply_global_filters, clean_filtered, format_millions, currency_column_config
 
 st.set_page_config(layout="wide")
 
 def main():
-    ensure_data_loaded()
-    df = st.session_state["df"]
+    df = ensure_data_loaded()
 
     st.title("Proveedores – Concentración del gasto")
     st.caption("Análisis de proveedores y concentración del gasto")
@@ -16,23 +15,17 @@ def main():
         st.warning("No hay datos con los filtros seleccionados.")
         return
 
-    # Asegurar que Monto sea numérico
-    filtered_clean = filtered.copy()
-    filtered_clean["Monto"] = pd.to_numeric(filtered_clean["Monto"], errors="coerce")
-    filtered_clean = filtered_clean.dropna(subset=["Monto", "Proveedor"])
+    # Agregado por proveedor (métricas compartidas; solo montos válidos)
+    metrics = get_metrics(filtered)
+    agg_proveedor = metrics.by("Proveedor")
     
-    if filtered_clean.empty:
+    if agg_proveedor.empty:
         st.warning("No hay datos válidos con los filtros seleccionados.")
         return
 
-    grp = (
-        filtered_clean.groupby("Proveedor")["Monto"]
-        .sum()
-        .sort_values(ascending=False)
-    )
+    grp = metrics.ranking("Proveedor")
     total = grp.sum()
 
-    top3 = grp.head(3).sum() if len(grp) >= 3 else grp.sum()
     top1_name = grp.index[0]
     top1_monto = grp.iloc[0]
     top1_pct = top1_monto / total * 100 if total != 0 else 0
@@ -45,7 +38,7 @@ def main():
     with c3:
         st.metric(
             "Top 3 concentran",
-            f"{top3 / total * 100:,.1f} %" if total != 0 else "0 %",
+            f"{metrics.top_share('Proveedor', 3):,.1f} %" if total != 0 else "0 %",
         )
 
     st.subheader("📊 Top 10 proveedores por gasto")
@@ -60,10 +53,9 @@ def main():
         help="Selecciona un proveedor para ver el detalle de todas sus transacciones"
     )
 
-    df_prov = filtered_clean[filtered_clean["Proveedor"] == proveedor_sel].copy()
-    gasto_prov = df_prov["Monto"].sum()
-    num_polizas = df_prov["Monto"].count()
-    ticket_prom = df_prov["Monto"].mean()
+    gasto_prov = agg_proveedor.loc[proveedor_sel, "sum"]
+    num_polizas = agg_proveedor.loc[proveedor_sel, "count"]
+    ticket_prom = agg_proveedor.loc[proveedor_sel, "mean"]
 
     c4, c5, c6 = st.columns(3)
     with c4:
@@ -73,6 +65,8 @@ def main():
     with c6:
         st.metric("Ticket promedio", f"${ticket_prom:,.2f}")
 
+    filtered_clean = clean_filtered(filtered, ["Monto", "Proveedor"])
+    df_prov = filtered_clean[filtered_clean["Proveedor"] == proveedor_sel]
     df_prov_display = df_prov[
         [
             "Mes",
@@ -85,14 +79,9 @@ def main():
             "Categoría",
             "Concepto Russildi",
         ]
-    ].sort_values("Fecha", ascending=False).copy()
-    
-    # Formatear columna Monto
-    df_prov_display["Monto"] = df_prov_display["Monto"].apply(
-        lambda x: f"${x:,.2f}" if pd.notna(x) else "$0.00"
-    )
-    
-    st.dataframe(df_prov_display, use_container_width=True)
+    ].sort_values("Fecha", ascending=False)
+
+    st.dataframe(df_prov_display, use_container_width=True, column_config=currency_column_config(["Monto"]))
 
 
 main()
\ No newline at end of file
@@ -1,13 +1,13 @@
 import streamlit as st
-import pandas as pd
 import numpy as np
-from utils import ensure_data_loaded, apply_global_filters, MONTH_NAMES, format_millions, create_monthly_bar_chart
+from anomalies import OUTLIER_MULTIPLIER, ROBUST_THRESHOLD, concept_outliers, get_anomaly_model, robust_limits, robust_stats, score_series
+from analytics import get_metrics
+from utils import ensure_data_loaded, apply_global_filters, clean_filtered, period_labels, format_millions, currency_column_config, monthly_chart_spec
 
 st.set_page_config(layout="wide")
 
 def main():
-    ensure_data_loaded()
-    df = st.session_state["df"]
+    df = ensure_data_loaded()
 
     st.title("Anomalías – Meses y pólizas atípicas")
     st.caption("Detección de patrones inusuales en el gasto mensual y por póliza")
@@ -17,76 +17,106 @@ def main():
         st.warning("No hay datos con los filtros seleccionados.")
         return
 
-    # Asegurar que Monto sea numérico
-    filtered_clean = filtered.copy()
-    filtered_clean["Monto"] = pd.to_numeric(filtered_clean["Monto"], errors="coerce")
-    filtered_clean = filtered_clean.dropna(subset=["Monto"])
+    # Gasto por periodo aaaamm (métricas compartidas; solo montos válidos)
+    metrics = get_metrics(filtered)
+    gasto_mes = metrics.monthly
+    etiquetas_mes = metrics.labels
     
-    if filtered_clean.empty:
+    if gasto_mes.empty:
         st.warning("No hay datos válidos con los filtros seleccionados.")
         return
 
 
-    # 1) Meses pico
-    st.subheader("Meses pico (nivel agregado)")
-    gasto_mes = filtered_clean.groupby("MesNum")["Monto"].sum().sort_index()
-    prom = gasto_mes.mean()
-    std = gasto_mes.std(ddof=0)
+    umbral = st.slider(
+        "Umbral del puntaje robusto",
+        min_value=2.0,
+        max_value=6.0,
+        value=ROBUST_THRESHOLD,
+        step=0.5,
+        help="Un mes es atípico si |0.6745 × (monto − mediana) / MAD| supera este umbral",
+    )
 
-    upper = prom + 1.5 * std
-    lower = prom - 1.5 * std
+    # 1) Meses pico (mediana y MAD: los propios picos no mueven los límites)
+    st.subheader("Meses pico (nivel agregado)")
+    mediana, mad = robust_stats(gasto_mes.to_numpy())
+    lower, upper = robust_limits(mediana, mad, umbral)
+    puntajes_mes = score_series(gasto_mes, umbral)
 
-    meses_out_alta = gasto_mes[gasto_mes > upper]
-    meses_out_baja = gasto_mes[gasto_mes < lower]
+    meses_out_alta = gasto_mes[puntajes_mes["Atipico"] & (puntajes_mes["Puntaje"] > 0)]
+    meses_out_baja = gasto_mes[puntajes_mes["Atipico"] & (puntajes_mes["Puntaje"] < 0)]
 
     col1, col2 = st.columns(2)
     with col1:
-        st.write("Promedio mensual:", format_millions(prom))
+        st.write("Mediana mensual:", format_millions(mediana))
         st.write("Límite alto:", format_millions(upper))
         st.write("Límite bajo:", format_millions(lower))
     with col2:
-        # Gráfico de barras con Altair (orden cronológico garantizado)
-        chart_barras = create_monthly_bar_chart(
+        # Gráfico de barras (orden cronológico garantizado; spec memorizado por serie)
+        spec_barras = monthly_chart_spec(
             gasto_mes,
+            mark="bar",
             title="Gasto por mes",
             value_column="Gasto (MXN)",
             include_all_months=False
         )
-        st.altair_chart(chart_barras, use_container_width=True)
+        st.vega_lite_chart(spec=spec_barras, use_container_width=True)
 
     if not meses_out_alta.empty:
         st.markdown("**Meses con gasto inusualmente alto:**")
         for m, v in meses_out_alta.items():
-            st.write(f"- {MONTH_NAMES.get(m, str(m))}: {format_millions(v)}")
+            st.write(f"- {etiquetas_mes[m]}: {format_millions(v)}")
     else:
         st.markdown("No se detectaron meses inusualmente altos.")
 
     if not meses_out_baja.empty:
         st.markdown("**Meses con gasto inusualmente bajo:**")
         for m, v in meses_out_baja.items():
-            st.write(f"- {MONTH_NAMES.get(m, str(m))}: {format_millions(v)}")
+            st.write(f"- {etiquetas_mes[m]}: {format_millions(v)}")
     else:
         st.markdown("No se detectaron meses inusualmente bajos.")
 
-    # 2) Pólizas outlier por concepto (simple: > 3x mediana)
-    st.subheader("Pólizas atípicas por concepto (Monto > 3× mediana del concepto)")
-
-    outlier_rows = []
-    for concepto, df_con in filtered_clean.groupby("Concepto Russildi"):
-        med = df_con["Monto"].median()
-        if med <= 0:
-            continue
-        mask = df_con["Monto"] > 3 * med
-        df_out = df_con[mask].copy()
-        if df_out.empty:
-            continue
-        df_out["MedianaConcepto"] = med
-        df_out["VecesMediana"] = df_out["Monto"] / med
-        outlier_rows.append(df_out)
-
-    if outlier_rows:
-        df_outliers = pd.concat(outlier_rows, ignore_index=True)
-
+    # 2) Series atípicas por concepto / proveedor (historial completo de cada serie)
+    st.subheader("Series atípicas por concepto y proveedor")
+    st.caption(
+        "Cada concepto o proveedor se compara con su propio historial mensual (mediana y MAD); "
+        "se muestran los meses atípicos dentro del periodo filtrado."
+    )
+    dimension = st.radio("Serie", ["Concepto Russildi", "Proveedor"], horizontal=True)
+    handle = st.session_state.get("dataset_handle")
+    modelo = get_anomaly_model(df, source=handle[0] if handle else "")
+    series_out = modelo.anomalies(
+        dimension,
+        period_start=int(gasto_mes.index.min()),
+        period_end=int(gasto_mes.index.max()),
+        values=metrics.ranking(dimension).index.tolist(),
+        threshold=umbral,
+    )
+    if not series_out.empty:
+        etiquetas_series = period_labels(series_out["Periodo"])
+        series_out_display = series_out.assign(
+            Periodo=series_out["Periodo"].map(etiquetas_series),
+            Puntaje=series_out["Puntaje"].round(1),
+        ).rename(columns={"Serie": dimension})
+        st.dataframe(series_out_display, use_container_width=True,
+                     column_config=currency_column_config(["Monto", "Mediana"]))
+    else:
+        st.info(f"No se detectaron meses atípicos en las series por {dimension}.")
+
+    # 3) Pólizas outlier por concepto (Monto > k × mediana del concepto)
+    multiplicador = st.slider(
+        "Multiplicador de la mediana",
+        min_value=1.5,
+        max_value=10.0,
+        value=OUTLIER_MULTIPLIER,
+        step=0.5,
+        help="Una póliza es atípica si su monto supera este múltiplo de la mediana de su concepto",
+    )
+    st.subheader(f"Pólizas atípicas por concepto (Monto > {multiplicador:g}× mediana del concepto)")
+
+    filtered_clean = clean_filtered(filtered, ["Monto"])
+    df_outliers = concept_outliers(filtered_clean, multiplier=multiplicador)
+
+    if not df_outliers.empty:
         df_outliers_display = df_outliers[
             [
                 "Mes",
@@ -99,19 +129,12 @@ def main():
                 "MedianaConcepto",
                 "VecesMediana",
             ]
-        ].sort_values("VecesMediana", ascending=False).copy()
-        
-        # Formatear columnas de moneda
-        df_outliers_display["Monto"] = df_outliers_display["Monto"].apply(
-            lambda x: f"${x:,.2f}" if pd.notna(x) else "$0.00"
-        )
-        df_outliers_display["MedianaConcepto"] = df_outliers_display["MedianaConcepto"].apply(
-            lambda x: f"${x:,.2f}" if pd.notna(x) else "$0.00"
-        )
-        
-        st.dataframe(df_outliers_display, use_container_width=True)
+        ].sort_values("VecesMediana", ascending=False)
+
+        st.dataframe(df_outliers_display, use_container_width=True,
+                     column_config=currency_column_config(["Monto", "MedianaConcepto"]))
     else:
-        st.info("No se encontraron pólizas que superen 3× la mediana de su concepto.")
+        st.info(f"No se encontraron pólizas que superen {multiplicador:g}× la mediana de su concepto.")
 
 
 main()
\ No newline at end of file
@@ -1,12 +1,30 @@
 import streamlit as st
-import pandas as pd
-from utils import ensure_data_loaded, apply_global_filters
+from utils import ensure_data_loaded, apply_global_filters, sort_keys, page_positions, currency_column_config
+from filter_engine import get_session_filter_cache
+from search_index import get_search_index
+from exports import EXPORT_FORMATS, available_formats, export_view
 
 st.set_page_config(layout="wide")
 
+DISPLAY_COLUMNS = [
+    "Mes",
+    "Fecha",
+    "FechaEstimada",
+    "Número",
+    "Póliza",
+    "Concepto",
+    "Proveedor",
+    "Monto",
+    "Categoría",
+    "Concepto Russildi",
+]
+PAGE_SIZES = [50, 100, 250, 500]
+
+# Vistas del Explorer (búsqueda + filtros de calidad) memorizadas por sesión
+EXPLORER_CACHE_SIZE = 2
+
 def main():
-    ensure_data_loaded()
-    df = st.session_state["df"]
+    df = ensure_data_loaded()
 
     st.title("Explorador de pólizas")
 
@@ -20,17 +38,10 @@ def main():
     # Buscador de texto
     search_text = st.text_input(
         "🔍 Buscar texto en Concepto o Proveedor",
-        help="Busca en los campos 'Concepto' y 'Proveedor' de forma simultánea"
+        help="Busca en los campos 'Concepto' y 'Proveedor' de forma simultánea, sin distinguir acentos "
+             "ni mayúsculas. Con varias palabras, cada una debe aparecer en alguno de los dos campos."
     )
 
-    df_view = filtered.copy()
-    if search_text:
-        mask = (
-            df_view["Concepto"].str.contains(search_text, case=False, na=False)
-            | df_view["Proveedor"].str.contains(search_text, case=False, na=False)
-        )
-        df_view = df_view[mask]
-
     # Checkboxes para calidad
     st.markdown("#### 🔍 Filtros de calidad de datos")
     col1, col2 = st.columns(2)
@@ -45,13 +56,34 @@ def main():
             help="Muestra únicamente registros que no tienen Concepto Russildi asignado"
         )
 
-    if solo_sin_categoria:
-        df_view = df_view[df_view["Categoría"].isna() | (df_view["Categoría"] == "")]
-    if solo_sin_concepto_r:
-        df_view = df_view[
-            df_view["Concepto Russildi"].isna()
-            | (df_view["Concepto Russildi"] == "")
-        ]
+    def build_view():
+        df_view = filtered
+        if search_text.strip():
+            # Índice de trigramas del dataset (se construye una vez); las posiciones
+            # de las filas filtradas se memorizan junto al DataFrame filtrado
+            index = get_search_index(df)
+            positions = get_session_filter_cache().derived(
+                filtered, ("search_positions",), lambda: index.positions(filtered)
+            )
+            df_view = filtered[index.mask(search_text, positions)]
+
+        if solo_sin_categoria:
+            df_view = df_view[df_view["Categoría"].isna() | (df_view["Categoría"] == "")]
+        if solo_sin_concepto_r:
+            df_view = df_view[
+                df_view["Concepto Russildi"].isna()
+                | (df_view["Concepto Russildi"] == "")
+            ]
+        return df_view
+
+    # La vista (búsqueda + filtros de calidad) se memoriza por sesión: cambiar
+    # de página o de orden no la recalcula
+    filters = st.session_state.get("global_filters")
+    view_key = None
+    if filters is not None and filters.dataset is not None:
+        view_key = (filters, search_text.strip(), solo_sin_categoria, solo_sin_concepto_r)
+    view_cache = get_session_filter_cache("explorer", EXPLORER_CACHE_SIZE)
+    df_view = view_cache.get_or_compute(view_key, build_view)
 
     # Mostrar contador
     col_count1, col_count2 = st.columns([1, 4])
@@ -61,43 +93,57 @@ def main():
     if df_view.empty:
         st.warning("No se encontraron movimientos con los filtros seleccionados.")
         return
-    
-    # Preparar datos para visualización
-    df_view_display = df_view[
-        [
-            "Mes",
-            "Fecha",
-            "Número",
-            "Póliza",
-            "Concepto",
-            "Proveedor",
-            "Monto",
-            "Categoría",
-            "Concepto Russildi",
-        ]
-    ].sort_values("Fecha", ascending=False).copy()
-    
-    # Formatear columna Monto
-    df_view_display["Monto"] = df_view_display["Monto"].apply(
-        lambda x: f"${x:,.2f}" if pd.notna(x) else "$0.00"
+
+    # Orden y paginación (el estado vive en la sesión, en las llaves de los widgets)
+    col_sort, col_dir, col_size, col_page = st.columns([2, 2, 1, 1])
+    with col_sort:
+        sort_column = st.selectbox("Ordenar por", DISPLAY_COLUMNS, index=DISPLAY_COLUMNS.index("Fecha"),
+                                   key="explorer_sort")
+    with col_dir:
+        descending = st.radio("Orden", ["Descendente", "Ascendente"], horizontal=True,
+                              key="explorer_direction") == "Descendente"
+    with col_size:
+        page_size = st.selectbox("Filas por página", PAGE_SIZES, index=PAGE_SIZES.index(100),
+                                 key="explorer_page_size")
+
+    # Al cambiar la vista, el orden o el tamaño de página se vuelve a la primera página
+    signature = (view_key, len(df_view), sort_column, descending, page_size)
+    if st.session_state.get("explorer_signature") != signature:
+        st.session_state["explorer_signature"] = signature
+        st.session_state["explorer_page"] = 1
+    n_pages = max(1, -(-len(df_view) // page_size))
+    with col_page:
+        page = st.number_input("Página", min_value=1, max_value=n_pages, step=1, key="explorer_page")
+
+    # Solo se ordenan las filas que pueden caer en la página y solo se
+    # formatea el tramo visible
+    keys = view_cache.derived(
+        df_view, ("sort_keys", sort_column, descending),
+        lambda: sort_keys(df_view[sort_column], ascending=not descending),
     )
-    
-    # Usar st.data_editor para mejor interactividad (solo lectura)
+    start = (int(page) - 1) * page_size
+    positions = page_positions(keys, start, start + page_size)
+    df_view_display = df_view[DISPLAY_COLUMNS].take(positions)
+
     st.dataframe(
         df_view_display,
         use_container_width=True,
         height=400,
+        column_config=currency_column_config(["Monto"]),
     )
+    st.caption(f"Filas {start + 1:,}–{start + len(positions):,} de {len(df_view):,} (página {int(page)} de {n_pages})")
 
-    # Export
-    if not df_view.empty:
-        csv = df_view.to_csv(index=False).encode("utf-8-sig")
-        st.download_button(
-            "Descargar CSV filtrado",
-            data=csv,
-            file_name="urbanizacion_filtrado.csv",
-            mime="text/csv",
-        )
-
+    # Export: el archivo se genera solo al pedir la descarga y se memoriza por
+    # firma de la vista y formato (caché compartida, segura entre hilos)
+    formats = available_formats(len(df_view))
+    for col, fmt in zip(st.columns(len(formats)), formats):
+        label, extension, mime = EXPORT_FORMATS[fmt]
+        with col:
+            st.download_button(
+                f"Descargar {label} filtrado",
+                data=lambda fmt=fmt: export_view(df_view, fmt, view_key),
+                file_name=f"urbanizacion_filtrado.{extension}",
+                mime=mime,
+            )
 
 main()
\ No newline at end of file
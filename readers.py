@@ -0,0 +1,424 @@
+"""
+Lectores de archivos de egresos.
+
+El formato se detecta una sola vez a partir de los primeros bytes
+(sniff_format) y read_table envía cada formato a su lector:
+
+- xlsx: read_xlsx_projected lee la primera hoja en modo streaming
+  (openpyxl read-only), ubica la fila de encabezados y construye solo las
+  columnas esperadas, por bloques, en arreglos tipados.
+- xls: pandas + xlrd.
+- csv: lector C de pandas, proyectando las columnas esperadas.
+- parquet / arrow: pyarrow.
+
+Además, write_snapshot / read_snapshot guardan y leen el dataset ya limpio
+(salida de load_data) como snapshot Parquet o Arrow IPC, con el diagnóstico
+de carga en los metadatos del esquema, para saltarse el parseo del Excel.
+"""
+import csv
+import io
+import json
+
+import numpy as np
+import pandas as pd
+
+# Columnas que usa la app; el resto de la hoja no se materializa
+EXPECTED_COLUMNS = [
+    "Mes",
+    "Número",
+    "Fecha",
+    "Póliza",
+    "Concepto",
+    "Proveedor",
+    "Monto",
+    "Categoría",
+    "Concepto Russildi",
+]
+
+# Filas a revisar al buscar los encabezados (por si hay títulos arriba de la tabla)
+HEADER_SEARCH_ROWS = 20
+CHUNK_ROWS = 50_000
+
+# Firmas (magic bytes) de los formatos soportados
+_ZIP_MAGIC = b"PK\x03\x04"
+_OLE_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+_PARQUET_MAGIC = b"PAR1"
+_ARROW_MAGIC = b"ARROW1"
+_SNIFF_BYTES = 4096
+
+
+def _header_label(value) -> str:
+    return "" if value is None else str(value).strip()
+
+
+def _convert_cell(value):
+    """Normaliza una celda igual que pandas: vacías como NaN y floats enteros como int."""
+    if value is None:
+        return np.nan
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _find_header(rows, columns, search_rows):
+    """
+    Busca la fila de encabezados entre las primeras filas.
+
+    Devuelve (labels, filas_previas) donde filas_previas son las filas leídas
+    antes de decidir (por si no hay coincidencias y la primera fila es el encabezado).
+    """
+    wanted = set(columns)
+    best = None
+    seen = []
+    for i, row in enumerate(rows):
+        labels = [_header_label(v) for v in row]
+        seen.append(row)
+        matches = len(wanted.intersection(labels))
+        if matches == len(wanted):
+            return labels, seen[i + 1:]
+        if matches > 0 and (best is None or matches > best[0]):
+            best = (matches, i, labels)
+        if i + 1 >= search_rows:
+            break
+    if best is not None:
+        _, i, labels = best
+        return labels, seen[i + 1:]
+    if not seen:
+        return [], []
+    return [_header_label(v) for v in seen[0]], seen[1:]
+
+
+def _typed_chunk(name: str, values: list) -> np.ndarray:
+    """Convierte un bloque de valores de una columna a su arreglo tipado."""
+    if name == "Monto":
+        return pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").to_numpy(dtype="float64")
+    if name == "Fecha":
+        return pd.to_datetime(pd.Series(values, dtype=object), errors="coerce").to_numpy()
+    return np.array([_convert_cell(v) for v in values], dtype=object)
+
+
+def read_xlsx_projected(content: bytes, columns: list = None, chunk_rows: int = CHUNK_ROWS,
+                        header_search_rows: int = HEADER_SEARCH_ROWS) -> pd.DataFrame:
+    """
+    Lee la primera hoja de un .xlsx proyectando solo las columnas indicadas.
+
+    Si la hoja no contiene todas las columnas esperadas se devuelven todas
+    las columnas del encabezado, para que el error de validación pueda
+    mostrar qué columnas sí se encontraron.
+
+    Args:
+        content: Bytes del archivo .xlsx
+        columns: Columnas a proyectar (por defecto EXPECTED_COLUMNS)
+        chunk_rows: Filas por bloque al construir los arreglos
+        header_search_rows: Filas a revisar para ubicar el encabezado
+
+    Returns:
+        DataFrame con las columnas proyectadas (Monto float64, Fecha datetime64)
+    """
+    import openpyxl
+
+    columns = EXPECTED_COLUMNS if columns is None else columns
+    wb = openpyxl.load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        rows = ws.iter_rows(values_only=True)
+        labels, pending_rows = _find_header(rows, columns, header_search_rows)
+
+        # Posición de la primera aparición de cada columna
+        positions = {}
+        for pos, label in enumerate(labels):
+            if label and label not in positions:
+                positions[label] = pos
+        if set(columns).issubset(positions):
+            names = list(columns)
+        else:
+            names = [label for label in positions]
+        idx = [positions[name] for name in names]
+
+        chunks = {name: [] for name in names}
+        buffers = {name: [] for name in names}
+        blank_run = 0
+
+        def flush():
+            for name in names:
+                if buffers[name]:
+                    chunks[name].append(_typed_chunk(name, buffers[name]))
+                    buffers[name] = []
+
+        def consume(row):
+            nonlocal blank_run
+            values = [row[i] if i < len(row) else None for i in idx]
+            if all(v is None for v in values):
+                # Las filas vacías intermedias se conservan; las finales se descartan
+                blank_run += 1
+                return
+            for _ in range(blank_run):
+                for name in names:
+                    buffers[name].append(None)
+            blank_run = 0
+            for name, value in zip(names, values):
+                buffers[name].append(value)
+            if len(buffers[names[0]]) >= chunk_rows:
+                flush()
+
+        if names:
+            for row in pending_rows:
+                consume(row)
+            for row in rows:
+                consume(row)
+            flush()
+    finally:
+        wb.close()
+
+    data = {}
+    for name in names:
+        if chunks[name]:
+            data[name] = np.concatenate(chunks[name])
+        else:
+            data[name] = _typed_chunk(name, [])
+    return pd.DataFrame(data, columns=names)
+
+
+def sniff_format(content: bytes) -> str:
+    """
+    Detecta el formato del archivo a partir de sus primeros bytes.
+
+    Returns:
+        "xlsx", "xls", "parquet", "arrow" o "csv"
+
+    Raises:
+        ValueError: Si el contenido no corresponde a ningún formato soportado
+    """
+    if not content:
+        raise ValueError("El archivo está vacío")
+    if content.startswith(_ZIP_MAGIC):
+        return "xlsx"
+    if content.startswith(_OLE_MAGIC):
+        return "xls"
+    if content.startswith(_PARQUET_MAGIC) and content.endswith(_PARQUET_MAGIC):
+        return "parquet"
+    if content.startswith(_ARROW_MAGIC):
+        return "arrow"
+
+    head = content[:_SNIFF_BYTES]
+    stripped = head.lstrip(b"\xef\xbb\xbf \t\r\n").lower()
+    if stripped.startswith((b"<!doctype html", b"<html", b"<?xml", b"<")):
+        raise ValueError(
+            "El archivo es una página HTML/XML y no una hoja de datos. "
+            "Si viene de Google Drive, verifica que esté compartido como 'Cualquiera con el enlace'"
+        )
+    if b"\x00" not in head and _csv_delimiter(head) is not None:
+        return "csv"
+
+    raise ValueError(
+        f"Formato de archivo no reconocido (primeros bytes: {content[:8]!r}). "
+        "Se esperaba un archivo .xlsx, .xls, .csv, .parquet o .arrow"
+    )
+
+
+def _decode_text(content: bytes) -> str:
+    for encoding in ("utf-8-sig", "latin-1"):
+        try:
+            return content.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return ""
+
+
+def _csv_encoding(content: bytes) -> str:
+    try:
+        content[:_SNIFF_BYTES * 16].decode("utf-8-sig")
+        return "utf-8-sig"
+    except UnicodeDecodeError:
+        return "latin-1"
+
+
+def _csv_delimiter(head: bytes):
+    """Devuelve el delimitador del CSV según la primera línea, o None si no parece CSV."""
+    first_line = _decode_text(head).splitlines()[0] if head.strip() else ""
+    try:
+        return csv.Sniffer().sniff(first_line, delimiters=",;\t|").delimiter
+    except csv.Error:
+        return None
+
+
+def _read_csv(content: bytes) -> pd.DataFrame:
+    sep = _csv_delimiter(content[:_SNIFF_BYTES]) or ","
+    buffer = io.BytesIO(content)
+    header = pd.read_csv(buffer, sep=sep, nrows=0, encoding=_csv_encoding(content)).columns
+    # Proyectar las columnas esperadas solo si están todas (si no, dejar que la validación las liste)
+    usecols = EXPECTED_COLUMNS if set(EXPECTED_COLUMNS).issubset(header) else None
+    buffer.seek(0)
+    return pd.read_csv(buffer, sep=sep, usecols=usecols, encoding=_csv_encoding(content))
+
+
+def _read_xls(content: bytes) -> pd.DataFrame:
+    try:
+        import xlrd  # noqa: F401
+    except ImportError:
+        raise ValueError("Para leer archivos .xls (Excel 97-2003) instala el paquete 'xlrd', o guarda el archivo como .xlsx")
+    return pd.read_excel(io.BytesIO(content), engine="xlrd")
+
+
+def _read_parquet(content: bytes) -> pd.DataFrame:
+    return _arrow_table(content, "parquet").to_pandas()
+
+
+def _read_arrow(content: bytes) -> pd.DataFrame:
+    return _arrow_table(content, "arrow").to_pandas()
+
+
+def _arrow_table(content: bytes, fmt: str):
+    try:
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ValueError("Para leer archivos Parquet/Arrow instala el paquete 'pyarrow'")
+    if fmt == "parquet":
+        return pyarrow.parquet.read_table(io.BytesIO(content))
+    return pyarrow.ipc.open_file(io.BytesIO(content)).read_all()
+
+
+_READERS = {
+    "xlsx": read_xlsx_projected,
+    "xls": _read_xls,
+    "csv": _read_csv,
+    "parquet": _read_parquet,
+    "arrow": _read_arrow,
+}
+
+
+def read_table(content: bytes) -> pd.DataFrame:
+    """
+    Lee la tabla de egresos detectando el formato una sola vez.
+
+    Cada archivo se parsea exactamente una vez con el lector de su formato.
+
+    Raises:
+        ValueError: Si el formato no se reconoce o el archivo no se puede leer
+    """
+    fmt = sniff_format(content)
+    try:
+        return _READERS[fmt](content)
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"No se pudo leer el archivo como {fmt}: {e}")
+
+
+# Llave de los metadatos del esquema que marca un snapshot del dataset limpio
+SNAPSHOT_METADATA_KEY = b"laquerencia.snapshot"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_FORMATS = ("parquet", "arrow")
+
+
+def _json_default(value):
+    # Valores numpy (int64, float64, ...) dentro del diagnóstico
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
+def arrow_compatible(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convierte a texto las columnas object con tipos mezclados (p. ej. Número
+    con texto y enteros), que Arrow no acepta. Los nulos se conservan.
+    """
+    mixed = [
+        col for col in df.columns
+        if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True).startswith("mixed")
+    ]
+    if mixed:
+        df = df.copy()
+        for col in mixed:
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
+
+
+def write_snapshot(df: pd.DataFrame, diagnostico=None, fmt: str = "parquet") -> bytes:
+    """
+    Serializa el dataset limpio como snapshot Parquet o Arrow IPC.
+
+    Args:
+        df: DataFrame limpio (salida de load_data)
+        diagnostico: Diagnóstico de carga a conservar en los metadatos
+        fmt: "parquet" o "arrow"
+
+    Returns:
+        Bytes del snapshot
+    """
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    if fmt not in SNAPSHOT_FORMATS:
+        raise ValueError(f"Formato de snapshot no soportado: {fmt}. Usa 'parquet' o 'arrow'")
+
+    table = pa.Table.from_pandas(arrow_compatible(df))
+    info = {"version": SNAPSHOT_VERSION, "diagnostico": diagnostico}
+    metadata = dict(table.schema.metadata or {})
+    metadata[SNAPSHOT_METADATA_KEY] = json.dumps(info, default=_json_default).encode("utf-8")
+    table = table.replace_schema_metadata(metadata)
+
+    sink = io.BytesIO()
+    if fmt == "parquet":
+        pyarrow.parquet.write_table(table, sink, compression="zstd")
+    else:
+        with pyarrow.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return sink.getvalue()
+
+
+def _snapshot_schema(content: bytes):
+    """
+    Devuelve el esquema si el contenido es un snapshot Parquet/Arrow, si no None.
+
+    Raises:
+        ValueError: Si el contenido parece Parquet/Arrow pero no se puede leer
+    """
+    try:
+        fmt = sniff_format(content)
+    except ValueError:
+        return None
+    if fmt not in SNAPSHOT_FORMATS:
+        return None
+    try:
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        return None
+    try:
+        if fmt == "parquet":
+            schema = pyarrow.parquet.read_schema(io.BytesIO(content))
+        else:
+            schema = pyarrow.ipc.open_file(io.BytesIO(content)).schema
+    except (pyarrow.ArrowException, OSError) as e:
+        raise ValueError(f"No se pudo leer el archivo como {fmt}: el contenido está dañado o incompleto ({e})")
+    if SNAPSHOT_METADATA_KEY not in (schema.metadata or {}):
+        return None
+    return schema
+
+
+def is_snapshot(content: bytes) -> bool:
+    """Indica si los bytes son un snapshot del dataset limpio (solo lee el esquema)."""
+    return _snapshot_schema(content) is not None
+
+
+def read_snapshot(content: bytes):
+    """
+    Lee un snapshot generado con write_snapshot.
+
+    Returns:
+        Tupla (df, diagnostico)
+
+    Raises:
+        ValueError: Si los bytes no son un snapshot válido
+    """
+    schema = _snapshot_schema(content)
+    if schema is None:
+        raise ValueError("El archivo no es un snapshot de La Querencia (Parquet/Arrow)")
+    info = json.loads(schema.metadata[SNAPSHOT_METADATA_KEY].decode("utf-8"))
+    if info.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Versión de snapshot no soportada: {info.get('version')}")
+    df = _arrow_table(content, sniff_format(content)).to_pandas()
+    return df, info.get("diagnostico")
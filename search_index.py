@@ -0,0 +1,161 @@
+"""
+Índice de búsqueda de texto del Explorer (Concepto y Proveedor).
+
+El índice se construye una vez por dataset, la primera vez que se busca:
+- cada columna se reduce a sus valores distintos (códigos enteros por fila,
+  como en el motor de filtros) y cada valor se normaliza una sola vez: sin
+  acentos y en minúsculas (fold_text);
+- sobre los valores normalizados se arma un índice invertido de trigramas
+  (trigrama -> valores que lo contienen), calculado con numpy sobre los
+  code points de todos los valores a la vez.
+
+Una búsqueda se separa en términos (todos deben aparecer, en Concepto o en
+Proveedor). Para cada término se intersectan las listas de sus trigramas y
+solo los valores candidatos se verifican como subcadena; el resultado es
+una tabla booleana por valor que se aplica a las filas con lut[codes]. El
+costo depende del número de valores distintos que comparten los trigramas,
+no del número de filas.
+"""
+import unicodedata
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from filter_engine import DatasetIndexCache
+
+# Columnas en las que busca el Explorer
+SEARCH_COLUMNS = ["Concepto", "Proveedor"]
+
+# Largo de los n-gramas del índice invertido
+NGRAM = 3
+
+
+def fold_text(value: str) -> str:
+    """Normaliza texto para comparaciones: sin espacios extremos, sin acentos y en minúsculas."""
+    decomposed = unicodedata.normalize("NFKD", value.strip())
+    if decomposed.isascii():
+        return decomposed.casefold()
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def search_terms(query: str) -> list:
+    """Términos normalizados de una búsqueda (separados por espacios, sin repetir)."""
+    return list(dict.fromkeys(fold_text(query).split()))
+
+
+def _gram_keys(chars: np.ndarray) -> np.ndarray:
+    """Llave int64 de cada trigrama de un arreglo de code points (21 bits por carácter)."""
+    return (chars[:-2] << 42) | (chars[1:-1] << 21) | chars[2:]
+
+
+def _code_points(text: str) -> np.ndarray:
+    return np.frombuffer(text.encode("utf-32-le"), dtype="uint32").astype("int64")
+
+
+class TextColumnIndex:
+    """Valores distintos de una columna de texto, normalizados, con su índice de trigramas."""
+
+    def __init__(self, values: pd.Series):
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            codes, uniques = values.cat.codes.to_numpy(), values.cat.categories
+        else:
+            codes, uniques = pd.factorize(values)
+        # Los nulos (código -1) apuntan a la última posición de la tabla por valor,
+        # que siempre es False
+        self.codes = codes.astype("int32")
+        self.folded = [fold_text(str(value)) for value in uniques]
+
+        # Trigramas de todos los valores de una vez: los textos se concatenan
+        # (con un separador) como code points y se descartan los trigramas
+        # que cruzan de un valor al siguiente
+        lengths = np.fromiter(map(len, self.folded), dtype="int64", count=len(self.folded))
+        chars = _code_points("\0".join(self.folded) + "\0" * NGRAM)
+        value_ids = np.repeat(np.arange(len(lengths), dtype="int32"), lengths + 1)
+        offsets = np.arange(len(value_ids)) - np.repeat(np.cumsum(lengths + 1) - (lengths + 1), lengths + 1)
+        valid = offsets <= (lengths - NGRAM)[value_ids]
+        keys, value_ids = _gram_keys(chars)[valid], value_ids[valid]
+
+        # Listas invertidas en formato CSR: trigramas distintos ordenados y,
+        # para cada uno, el tramo de valores (sin repetir) que lo contienen
+        order = np.lexsort((value_ids, keys))
+        keys, value_ids = keys[order], value_ids[order]
+        distinct = np.ones(len(keys), dtype=bool)
+        distinct[1:] = (np.diff(keys) != 0) | (np.diff(value_ids) != 0)
+        keys, self.postings = keys[distinct], value_ids[distinct]
+        starts = np.flatnonzero(np.r_[True, np.diff(keys) != 0]) if len(keys) else np.empty(0, dtype="int64")
+        self.grams = keys[starts]
+        self.gram_bounds = np.append(starts, len(keys))
+
+    def _posting(self, key: int) -> np.ndarray:
+        i = int(np.searchsorted(self.grams, key))
+        if i == len(self.grams) or self.grams[i] != key:
+            return self.postings[:0]
+        return self.postings[self.gram_bounds[i]:self.gram_bounds[i + 1]]
+
+    def _candidates(self, term: str):
+        """Valores que contienen todos los trigramas del término (None si es más corto)."""
+        if len(term) < NGRAM:
+            return None
+        lists = sorted((self._posting(key) for key in np.unique(_gram_keys(_code_points(term)))), key=len)
+        candidates = lists[0]
+        for ids in lists[1:]:
+            if len(candidates) == 0:
+                break
+            candidates = np.intersect1d(candidates, ids, assume_unique=True)
+        return candidates
+
+    def lut(self, term: str) -> np.ndarray:
+        """Tabla booleana por valor (más una posición para nulos): True si contiene el término."""
+        lut = np.zeros(len(self.folded) + 1, dtype=bool)
+        candidates = self._candidates(term)
+        if candidates is None:
+            candidates = range(len(self.folded))
+        for value_id in candidates:
+            if term in self.folded[value_id]:
+                lut[value_id] = True
+        return lut
+
+
+class SearchIndex:
+    """Índice de búsqueda de un dataset (solo lectura)."""
+
+    def __init__(self, df: pd.DataFrame):
+        self.row_labels = df.index
+        self.columns = {col: TextColumnIndex(df[col]) for col in SEARCH_COLUMNS if col in df.columns}
+
+    def positions(self, frame: pd.DataFrame) -> np.ndarray:
+        """Posiciones en el dataset de las filas de un subconjunto (p. ej. el DataFrame filtrado)."""
+        return self.row_labels.get_indexer(frame.index)
+
+    def mask(self, query: str, positions: np.ndarray) -> np.ndarray:
+        """
+        Filas que coinciden con la búsqueda.
+
+        Args:
+            query: Texto buscado; cada término (separado por espacios) debe
+                aparecer en alguna de las columnas, sin distinguir acentos ni
+                mayúsculas
+            positions: Posiciones de las filas a evaluar (ver positions)
+
+        Returns:
+            Máscara booleana del tamaño de positions
+        """
+        mask = np.ones(len(positions), dtype=bool)
+        for term in search_terms(query):
+            matches = np.zeros(len(positions), dtype=bool)
+            for column in self.columns.values():
+                matches |= column.lut(term)[column.codes[positions]]
+            mask &= matches
+        return mask
+
+
+@st.cache_resource
+def get_search_index_cache() -> DatasetIndexCache:
+    """Instancia única de la caché de índices de búsqueda, compartida por todas las sesiones."""
+    return DatasetIndexCache(SearchIndex)
+
+
+def get_search_index(df: pd.DataFrame) -> SearchIndex:
+    """Índice de búsqueda del DataFrame compartido (se construye una sola vez)."""
+    return get_search_index_cache().get(df)
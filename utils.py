@@ -1,8 +1,19 @@
+import hashlib
+from dataclasses import asdict, dataclass, field, fields
+from typing import Optional
+
 import pandas as pd
 import numpy as np
 import streamlit as st
 import altair as alt
 
+from data_cache import get_dataset_cache, get_dataset_registry, get_download_cache
+from anomalies import get_anomaly_model
+from cube import aggregate_rows, can_use_cube, get_monto_cube
+from filter_engine import DIMENSION_COLUMNS, OPTIONS_CACHE_SIZE, GlobalFilters, get_filter_index, get_session_filter_cache
+from search_index import fold_text
+from readers import EXPECTED_COLUMNS, is_snapshot, read_snapshot, read_table, write_snapshot
+
 MONTH_MAP = {
     # Español completo
     "Enero": 1,
@@ -62,22 +73,165 @@ MONTH_NAMES = {
     12: "Diciembre",
 }
 
-def load_data_from_url(url: str) -> pd.DataFrame:
+
+# MONTH_MAP con llaves normalizadas (sin acentos, minúsculas)
+MONTH_MAP_FOLDED = {fold_text(nombre): num for nombre, num in MONTH_MAP.items()}
+
+
+# Esquema declarado del dataset limpio:
+# - dimensiones de baja cardinalidad como category (agrupar/filtrar sin re-hashear strings)
+# - texto libre como string
+# - MesNum y Año como enteros compactos, y Periodo (llave aaaamm) como int32
+CATEGORY_COLUMNS = ["Mes", "Proveedor", "Concepto Russildi", "Categoría"]
+TEXT_COLUMNS = ["Concepto", "Póliza"]
+INTEGER_COLUMNS = {"MesNum": "int8", "Año": "int16", "Periodo": "int32"}
+
+# Strings respaldados por Arrow cuando pyarrow está disponible (más compactos)
+try:
+    import pyarrow  # noqa: F401
+    TEXT_DTYPE = "string[pyarrow]"
+except ImportError:
+    TEXT_DTYPE = "string"
+
+
+def apply_schema(df: pd.DataFrame) -> pd.DataFrame:
     """
-    Carga datos desde una URL (Google Drive, Google Sheets, Dropbox, etc.)
-    
+    Aplica el esquema declarado (CATEGORY_COLUMNS, TEXT_COLUMNS, INTEGER_COLUMNS).
+
+    Los valores de las columnas de texto se convierten a str (los vacíos se
+    conservan como nulos). Las columnas enteras con nulos usan el tipo entero
+    nullable equivalente (p. ej. Int16).
+    """
+    columns = {}
+    for col in CATEGORY_COLUMNS + TEXT_COLUMNS:
+        if col not in df.columns:
+            continue
+        values = df[col].astype(object)
+        values = values.where(values.isna(), values.astype(str))
+        columns[col] = values.astype("category" if col in CATEGORY_COLUMNS else TEXT_DTYPE)
+    for col, dtype in INTEGER_COLUMNS.items():
+        if col not in df.columns:
+            continue
+        if df[col].isna().any():
+            dtype = dtype.capitalize()
+        columns[col] = df[col].astype(dtype)
+    return df.assign(**columns)
+
+
+def period_key(año: pd.Series, mes_num: pd.Series) -> pd.Series:
+    """Llave entera de periodo aaaamm (p. ej. 202501) a partir de Año y MesNum."""
+    return año.astype("int64") * 100 + mes_num.astype("int64")
+
+
+def shift_period(period: int, months: int) -> int:
+    """Desplaza un periodo aaaamm por `months` meses (puede cruzar de año)."""
+    año, mes = divmod(int(period), 100)
+    total = año * 12 + (mes - 1) + months
+    return (total // 12) * 100 + total % 12 + 1
+
+
+def period_labels(periods) -> dict:
+    """
+    Etiquetas de periodos para gráficos y textos.
+
+    Acepta llaves aaaamm o MesNum (1-12). Si todos los periodos son del mismo
+    año se usa solo el nombre del mes ("Enero"); si no, mes y año ("Enero 2025").
+
+    Returns:
+        Diccionario periodo -> etiqueta
+    """
+    periods = [int(p) for p in periods]
+    years = {p // 100 for p in periods if p > 12}
+    labels = {}
+    for p in periods:
+        if p <= 12:
+            labels[p] = MONTH_NAMES.get(p, str(p))
+        elif len(years) <= 1:
+            labels[p] = MONTH_NAMES.get(p % 100, str(p))
+        else:
+            labels[p] = f"{MONTH_NAMES.get(p % 100, str(p % 100))} {p // 100}"
+    return labels
+
+
+def _add_missing_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Completa columnas derivadas que no existían en snapshots anteriores."""
+    columns = {}
+    if "FechaEstimada" not in df.columns:
+        columns["FechaEstimada"] = False
+    if "Periodo" not in df.columns:
+        columns["Periodo"] = period_key(df["Año"], df["MesNum"]).astype("int32")
+    return df.assign(**columns) if columns else df
+
+
+def dataset_memory_report(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Reporte de memoria por columna del dataset.
+
+    Returns:
+        DataFrame indexado por columna con 'Tipo', 'Valores distintos' y
+        'Memoria (MB)', más una fila 'Total'
+    """
+    memory = df.memory_usage(deep=True, index=False)
+    report = pd.DataFrame({
+        "Tipo": df.dtypes.astype(str),
+        "Valores distintos": df.nunique(dropna=True),
+        "Memoria (MB)": memory / 1_000_000,
+    })
+    report.loc["Total"] = ["", np.nan, memory.sum() / 1_000_000]
+    return report
+
+
+def normalize_months(mes: pd.Series):
+    """
+    Normaliza la columna Mes y la mapea a número de mes en una sola pasada.
+
+    El texto se normaliza una vez por valor distinto (no por fila): se quitan
+    espacios, acentos y mayúsculas, y se busca en MONTH_MAP_FOLDED.
+
     Args:
-        url: URL del archivo Excel o Google Sheets
-    
+        mes: Columna Mes tal como se leyó del archivo
+
     Returns:
-        pd.DataFrame con los datos cargados
-    
-    Raises:
-        Exception: Si no se puede descargar o leer el archivo
+        Tupla (etiquetas, mes_num): la columna Mes como texto sin espacios
+        extremos (los vacíos quedan como 'nan') y MesNum como float (NaN si
+        el mes no se reconoce)
     """
-    import requests
-    import io
-    
+    codes, uniques = pd.factorize(mes.astype(object), use_na_sentinel=False)
+    labels = np.array([str(u).strip() for u in uniques], dtype=object)
+    nums = np.array([MONTH_MAP_FOLDED.get(fold_text(label), np.nan) for label in labels], dtype=float)
+    return (
+        pd.Series(labels[codes], index=mes.index, dtype=object),
+        pd.Series(nums[codes], index=mes.index, dtype=float),
+    )
+
+
+def estimate_missing_dates(fecha: pd.Series, mes_num: pd.Series, año: int):
+    """
+    Asigna fecha estimada (día 15 del mes, en el año indicado) a los registros
+    sin fecha pero con mes válido, en bloque.
+
+    Returns:
+        Tupla (fecha, estimadas): la columna Fecha completada y la cantidad de
+        fechas estimadas
+    """
+    mask = (fecha.isna() & mes_num.notna()).to_numpy()
+    estimadas = int(mask.sum())
+    if estimadas == 0:
+        return fecha, 0
+
+    meses = mes_num.to_numpy()[mask].astype(int)
+    fechas_estimadas = pd.to_datetime({
+        "year": np.full(estimadas, año),
+        "month": meses,
+        "day": np.full(estimadas, 15),
+    })
+    fecha = fecha.copy()
+    fecha.iloc[np.flatnonzero(mask)] = fechas_estimadas.to_numpy()
+    return fecha, estimadas
+
+
+def _resolve_download_url(url: str) -> str:
+    """Convierte enlaces de Google Sheets / Google Drive a su URL de descarga directa."""
     # Si es Google Sheets, convertir a formato de exportación Excel
     if "docs.google.com/spreadsheets" in url:
         # Extraer el ID del spreadsheet
@@ -89,10 +243,10 @@ def load_data_from_url(url: str) -> pd.DataFrame:
             raise ValueError("URL de Google Sheets no válida. Debe contener '/d/' o 'id='")
         
         # Convertir a formato de exportación Excel
-        url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=xlsx"
+        return f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=xlsx"
     
     # Si es Google Drive, convertir a formato de descarga directa
-    elif "drive.google.com" in url:
+    if "drive.google.com" in url:
         # Extraer el ID del archivo
         if "/d/" in url:
             file_id = url.split("/d/")[1].split("/")[0]
@@ -102,62 +256,309 @@ def load_data_from_url(url: str) -> pd.DataFrame:
             raise ValueError("URL de Google Drive no válida. Debe contener '/d/' o 'id='")
         
         # Usar formato de descarga directa
-        url = f"https://drive.google.com/uc?export=download&id={file_id}"
+        return f"https://drive.google.com/uc?export=download&id={file_id}"
+
+    return url
+
+
+def _validate_download(response) -> None:
+    """Verifica que la respuesta descargada no esté vacía ni sea una página de error."""
+    # Verificar que el contenido sea válido
+    if len(response.content) == 0:
+        raise ValueError("El archivo descargado está vacío")
+    
+    # Verificar el Content-Type para asegurar que es un archivo Excel
+    content_type = response.headers.get('Content-Type', '').lower()
+    if 'html' in content_type and len(response.content) < 10000:
+        # Podría ser una página de error de Google
+        raise ValueError("No se pudo descargar el archivo. Verifica que el archivo esté compartido como 'Cualquiera con el enlace'")
+
+
+def _download_bytes(url: str, refresh: bool = False) -> bytes:
+    """
+    Descarga el archivo una sola vez, usando la caché de descargas del proceso.
+
+    Args:
+        url: URL del archivo (se convierte a descarga directa si es de Google)
+        refresh: Si True, ignora el TTL y revalida con el servidor
+    """
+    return get_download_cache().fetch(
+        _resolve_download_url(url),
+        timeout=60,
+        validate=_validate_download,
+        force_revalidate=refresh,
+    )
+
+
+@dataclass
+class LoadReport:
+    """
+    Diagnóstico estructurado de una carga, independiente de Streamlit.
+
+    Attributes:
+        rows_total: Registros en el archivo
+        rows_final: Registros que quedaron después de limpiar
+        unmapped_count: Registros con mes no reconocido
+        unmapped_months: Valores de 'Mes' no reconocidos
+        meses_unicos: Todos los valores distintos de 'Mes'
+        fechas_estimadas: Registros a los que se asignó fecha estimada (día 15)
+        año_estimado: Año usado para las fechas estimadas
+        perdidos_por_mes: Filas (dict) de los meses que perdieron registros
+        razones_exclusion: Resumen de las razones de exclusión
+        conteo_mes_original: Filas (dict) con el conteo por valor de 'Mes' del
+            archivo original: 'Mes', 'Registros' y 'MesNum' (None si no se reconoce)
+    """
+    rows_total: int
+    rows_final: int
+    unmapped_count: int
+    unmapped_months: list
+    meses_unicos: list
+    fechas_estimadas: int
+    año_estimado: int
+    perdidos_por_mes: list
+    razones_exclusion: list
+    conteo_mes_original: list = field(default_factory=list)
+
+    @property
+    def excluidos(self) -> int:
+        return self.rows_total - self.rows_final
+
+    def to_dict(self) -> dict:
+        """Representación serializable (JSON) del reporte."""
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LoadReport":
+        return cls(**{f.name: data[f.name] for f in fields(cls) if f.name in data})
+
+    @property
+    def meses_no_reconocidos(self) -> list:
+        """Valores de 'Mes' del archivo original que no se pudieron mapear."""
+        return [row["Mes"] for row in self.conteo_mes_original if row["MesNum"] is None]
+
+
+@dataclass
+class IngestResult:
+    """
+    Resultado de una ingesta: un solo parse del archivo.
+
+    Attributes:
+        df: Dataset limpio compartido (solo lectura), o None si la limpieza falló
+        df_raw: Hoja tal como se leyó del archivo; None si el dataset vino de la caché.
+            No se guarda en la sesión (ver LoadReport.conteo_mes_original y read_raw_rows)
+        diagnostico: Diagnóstico de carga (ver render_load_diagnostics), o None si falló
+        error: Mensaje de error de la limpieza, si lo hubo
+        source: Origen de los datos (URL o nombre de archivo)
+        handle: Handle del dataset en el registro compartido (ver get_shared_dataset)
+    """
+    df: Optional[pd.DataFrame]
+    df_raw: Optional[pd.DataFrame]
+    diagnostico: Optional[LoadReport]
+    error: Optional[str] = None
+    source: str = ""
+    handle: Optional[tuple] = None
+
+
+def ingest_bytes(content: bytes, source: str = "") -> IngestResult:
+    """
+    Parsea y limpia los bytes de un libro una sola vez.
+
+    Si el contenido ya está en la caché, o es un snapshot Parquet/Arrow del
+    dataset limpio, se devuelve el dataset sin parsear ni normalizar (df_raw
+    queda en None). Si la limpieza falla (por ejemplo, faltan columnas) se
+    devuelve df_raw junto con el error para poder diagnosticarlo.
+
+    El dataset se registra en el registro compartido del proceso: todas las
+    sesiones que cargan el mismo contenido comparten el mismo DataFrame, que
+    no se debe modificar.
+    """
+    cache = get_dataset_cache()
+    key = cache.key_for(content)
+    cached = cache.get(key)
+    df_raw = None
+    if cached is not None:
+        df_final, diagnostico = cached
+    elif is_snapshot(content):
+        df_final, diagnostico = read_snapshot(content)
+        diagnostico = LoadReport.from_dict(diagnostico) if diagnostico else None
+        df_final = _add_missing_columns(df_final)
+        cache.put(key, df_final, diagnostico)
+    else:
+        df_raw = read_table(content)
+        try:
+            df_final, diagnostico = _clean_data(df_raw)
+        except ValueError as e:
+            return IngestResult(df=None, df_raw=df_raw, diagnostico=None, error=str(e), source=source)
+        cache.put(key, df_final, diagnostico)
+
+    handle = get_dataset_registry().register(source, key, df_final, diagnostico)
+    # El índice de filtros y el cubo se construyen al cargar, no en el primer filtro
+    get_filter_index(df_final)
+    get_monto_cube(df_final)
+    get_anomaly_model(df_final, source)
+    return IngestResult(df=df_final, df_raw=df_raw, diagnostico=diagnostico, source=source, handle=handle)
+
+
+def read_raw_rows(source, meses: list = None) -> pd.DataFrame:
+    """
+    Vuelve a leer las filas originales del archivo, bajo demanda.
+
+    La hoja original no se conserva en memoria después de la ingesta; esta
+    función la re-lee (las URLs usan la caché de descargas).
+
+    Args:
+        source: URL, archivo subido, objeto file-like o ruta
+        meses: Si se indica, solo las filas cuyo 'Mes' (capitalizado) esté en la lista
+
+    Raises:
+        ValueError: Si el origen es un snapshot (no conserva las filas originales)
+    """
+    if isinstance(source, str) and source.startswith(("http://", "https://")):
+        content = _download_bytes(source)
+    else:
+        content = _read_file_bytes(source)
+    if is_snapshot(content):
+        raise ValueError("Los snapshots no conservan las filas originales del archivo")
+
+    df_raw = read_table(content)
+    if meses is not None and "Mes" in df_raw.columns:
+        etiquetas = normalize_months(df_raw["Mes"])[0].str.capitalize()
+        df_raw = df_raw[etiquetas.isin(meses).to_numpy()]
+    return df_raw
+
+
+def get_shared_dataset(handle: tuple):
+    """
+    Devuelve (df, diagnostico) del registro compartido, o None si el handle
+    ya no está disponible. El DataFrame es compartido: no modificarlo.
+    """
+    return get_dataset_registry().get(handle)
+
+
+def set_session_dataset(result: IngestResult) -> None:
+    """Guarda en la sesión solo el handle del dataset compartido."""
+    st.session_state["dataset_handle"] = result.handle
+
+
+def get_session_df() -> Optional[pd.DataFrame]:
+    """DataFrame compartido (solo lectura) de la sesión actual, o None si no hay datos."""
+    handle = st.session_state.get("dataset_handle")
+    if handle is None:
+        return None
+    entry = get_shared_dataset(handle)
+    if entry is None:
+        return None
+    return entry[0]
+
+
+def ingest_file(file, source: str = "") -> IngestResult:
+    """Ingresa un archivo subido, objeto file-like o ruta (ver ingest_bytes)."""
+    if not source:
+        source = getattr(file, "name", "") or (file if isinstance(file, str) else "")
+    return ingest_bytes(_read_file_bytes(file), source=source)
+
+
+def ingest_url(url: str, refresh: bool = False) -> IngestResult:
+    """
+    Descarga una URL (Google Drive, Google Sheets, Dropbox, etc.) una sola vez
+    y la ingresa (ver ingest_bytes).
+
+    Args:
+        url: URL del archivo Excel o Google Sheets
+        refresh: Si True, revalida la descarga aunque siga dentro del TTL
+
+    Raises:
+        Exception: Si no se puede descargar el archivo
+    """
+    import requests
+
+    try:
+        content = _download_bytes(url, refresh=refresh)
+    except requests.exceptions.RequestException as e:
+        raise Exception(f"Error al descargar el archivo desde la URL: {str(e)}")
+    return ingest_bytes(content, source=url)
+
+
+def check_ingest_result(result: IngestResult) -> None:
+    """Convierte el error de una ingesta en ValueError, incluyendo las columnas encontradas."""
+    if result.error is None:
+        return
+    message = result.error
+    if result.df_raw is not None:
+        message += f". Columnas encontradas: {list(result.df_raw.columns)}"
+    raise ValueError(message)
+
+
+def load_data_from_url(url: str) -> pd.DataFrame:
+    """
+    Carga datos desde una URL (Google Drive, Google Sheets, Dropbox, etc.)
+    
+    Args:
+        url: URL del archivo Excel o Google Sheets
     
-    # Descargar el archivo
+    Returns:
+        pd.DataFrame con los datos cargados
+    
+    Raises:
+        Exception: Si no se puede descargar o leer el archivo
+    """
+    import requests
+
+    # Descargar el archivo una sola vez y parsearlo una sola vez
     try:
-        response = requests.get(url, timeout=60, allow_redirects=True)
-        response.raise_for_status()
-        
-        # Verificar que el contenido sea válido
-        if len(response.content) == 0:
-            raise ValueError("El archivo descargado está vacío")
-        
-        # Verificar el Content-Type para asegurar que es un archivo Excel
-        content_type = response.headers.get('Content-Type', '').lower()
-        if 'html' in content_type and len(response.content) < 10000:
-            # Podría ser una página de error de Google
-            raise ValueError("No se pudo descargar el archivo. Verifica que el archivo esté compartido como 'Cualquiera con el enlace'")
-        
-        # Leer como Excel especificando el engine explícitamente
-        file_like = io.BytesIO(response.content)
-        return load_data(file_like)
+        content = _download_bytes(url)
+        result = ingest_bytes(content, source=url)
+        check_ingest_result(result)
     except requests.exceptions.RequestException as e:
         raise Exception(f"Error al descargar el archivo desde la URL: {str(e)}")
     except Exception as e:
         raise Exception(f"Error al procesar el archivo: {str(e)}")
 
+    render_load_diagnostics(result.diagnostico)
+    return result.df
+
+
+def _read_file_bytes(file) -> bytes:
+    """Obtiene los bytes de un archivo subido, un objeto file-like o una ruta."""
+    if isinstance(file, (bytes, bytearray)):
+        return bytes(file)
+    if hasattr(file, "getvalue"):
+        return file.getvalue()
+    if hasattr(file, "read"):
+        if hasattr(file, "seek"):
+            file.seek(0)
+        return file.read()
+    with open(file, "rb") as fh:
+        return fh.read()
+
 
 def load_data(file) -> pd.DataFrame:
     """Carga y prepara el archivo de Urbanización."""
     # Si es una URL string, usar load_data_from_url
     if isinstance(file, str) and (file.startswith("http://") or file.startswith("https://")):
         return load_data_from_url(file)
-    
-    # Si es un objeto file-like o path, leer directamente
-    # Especificar engine explícitamente para evitar errores de formato
-    try:
-        df = pd.read_excel(file, engine='openpyxl')
-    except Exception:
-        # Si falla con openpyxl, intentar con xlrd para archivos .xls antiguos
-        try:
-            df = pd.read_excel(file, engine='xlrd')
-        except Exception:
-            # Último intento sin especificar engine
-            df = pd.read_excel(file)
+
+    result = ingest_file(file)
+    check_ingest_result(result)
+    render_load_diagnostics(result.diagnostico)
+    return result.df
+
+
+def _clean_data(df_raw: pd.DataFrame):
+    """
+    Aplica la limpieza de load_data sobre la hoja leída (sin modificarla).
+
+    Returns:
+        Tupla (df_final, report) donde report es el LoadReport con la
+        información que se muestra al usuario (ver render_load_diagnostics).
+
+    Raises:
+        ValueError: Si faltan columnas esperadas
+    """
+    df = df_raw.copy()
 
     # Validación mínima de columnas
-    expected_cols = {
-        "Mes",
-        "Número",
-        "Fecha",
-        "Póliza",
-        "Concepto",
-        "Proveedor",
-        "Monto",
-        "Categoría",
-        "Concepto Russildi",
-    }
+    expected_cols = set(EXPECTED_COLUMNS)
     missing = expected_cols.difference(df.columns)
     if missing:
         raise ValueError(f"Faltan columnas en el archivo: {missing}")
@@ -169,78 +570,24 @@ def load_data(file) -> pd.DataFrame:
     # Guardar total original para diagnóstico
     rows_total = len(df)
     
-    # Normalizar nombres de meses: eliminar espacios, convertir a string
-    df["Mes"] = df["Mes"].astype(str).str.strip()
-    
-    # Crear mapeo más robusto que maneje múltiples variantes
-    # Incluir variantes comunes: minúsculas, mayúsculas, capitalizado, etc.
-    month_map_extended = {}
-    
-    # Agregar todas las variantes del MONTH_MAP
-    for mes_nombre, mes_num in MONTH_MAP.items():
-        # Variantes: original, minúsculas, mayúsculas, capitalizado, título
-        variants = [
-            mes_nombre.strip(),
-            mes_nombre.strip().lower(),
-            mes_nombre.strip().upper(),
-            mes_nombre.strip().capitalize(),
-            mes_nombre.strip().title(),
-        ]
-        for variant in variants:
-            month_map_extended[variant] = mes_num
-    
-    # Mapear meses usando el diccionario extendido
-    df["MesNum"] = df["Mes"].map(month_map_extended)
-    
-    # Si aún hay valores sin mapear, intentar normalización adicional
-    unmapped = df[df["MesNum"].isna()]["Mes"].unique()
-    if len(unmapped) > 0:
-        # Intentar mapear manualmente casos especiales
-        for mes_val in unmapped:
-            mes_clean = mes_val.strip().lower()
-            # Buscar coincidencias parciales
-            for mes_estandar, mes_num in MONTH_MAP.items():
-                if mes_clean == mes_estandar.lower().strip():
-                    df.loc[df["Mes"] == mes_val, "MesNum"] = mes_num
-                    break
-    
-    # Diagnóstico detallado por mes
-    rows_before_clean = len(df)
-    
-    # Contar registros con problemas
-    sin_fecha = df["Fecha"].isna().sum()
-    sin_monto = df["Monto"].isna().sum()
-    sin_mesnum = df["MesNum"].isna().sum()
-    
-    # Meses que no se mapearon
-    unmapped_months = df[df["MesNum"].isna()]["Mes"].unique()
-    unmapped_count = len(df[df["MesNum"].isna()])
-    
-    # Análisis detallado por mes ANTES de limpiar
-    df_diagnostico = df.copy()
-    df_diagnostico["tiene_fecha"] = df_diagnostico["Fecha"].notna()
-    df_diagnostico["tiene_monto"] = df_diagnostico["Monto"].notna()
-    df_diagnostico["tiene_mesnum"] = df_diagnostico["MesNum"].notna()
-    
-    # Agrupar por mes y contar problemas
-    diagnostico_por_mes = df_diagnostico.groupby("Mes").agg({
-        "MesNum": "count",  # Total de registros
-        "tiene_fecha": "sum",  # Cuántos tienen fecha
-        "tiene_monto": "sum",  # Cuántos tienen monto
-        "tiene_mesnum": "sum",  # Cuántos tienen mesnum
-    }).rename(columns={
-        "MesNum": "total",
-        "tiene_fecha": "con_fecha",
-        "tiene_monto": "con_monto",
-        "tiene_mesnum": "con_mesnum"
-    })
-    
-    # Mostrar diagnóstico detallado
-    if unmapped_count > 0:
-        st.warning(f"⚠️ **{unmapped_count} registros** tienen meses no reconocidos y serán excluidos.")
-        st.write(f"**Valores de 'Mes' no reconocidos:** {sorted([m for m in unmapped_months if m != 'nan'])}")
-        meses_unicos = sorted([m for m in df['Mes'].unique() if pd.notna(m)])
-        st.write(f"**Valores únicos en columna 'Mes' (todos):** {meses_unicos}")
+    # Normalizar nombres de meses (texto sin espacios) y mapearlos a número de mes
+    df["Mes"], df["MesNum"] = normalize_months(df["Mes"])
+    
+    # Conteos por mes ANTES de limpiar (antes de estimar fechas), en una sola agrupación
+    diagnostico_por_mes = pd.DataFrame({
+        "Mes": df["Mes"].to_numpy(),
+        "MesNum": df["MesNum"].to_numpy(),
+        "con_fecha": df["Fecha"].notna().to_numpy(),
+        "con_monto": df["Monto"].notna().to_numpy(),
+    }).groupby("Mes", sort=True).agg(
+        total=("MesNum", "size"),
+        con_fecha=("con_fecha", "sum"),
+        con_monto=("con_monto", "sum"),
+        con_mesnum=("MesNum", "count"),
+        mes_num=("MesNum", "first"),
+    )
+    unmapped = diagnostico_por_mes[diagnostico_por_mes["con_mesnum"] == 0]
+    unmapped_count = int(unmapped["total"].sum())
     
     # Crear fechas estimadas para registros sin fecha pero con mes válido
     # Determinar el año más común en los registros que sí tienen fecha
@@ -248,192 +595,442 @@ def load_data(file) -> pd.DataFrame:
     año_estimado = int(años_disponibles.mode()[0]) if len(años_disponibles) > 0 else 2025
     
     # Para registros sin fecha pero con MesNum válido, crear fecha estimada (día 15 del mes)
-    sin_fecha_con_mes = df[(df["Fecha"].isna()) & (df["MesNum"].notna())]
-    if len(sin_fecha_con_mes) > 0:
-        for idx in sin_fecha_con_mes.index:
-            mes_num = df.loc[idx, "MesNum"]
-            # Crear fecha estimada: día 15 del mes correspondiente
-            try:
-                fecha_estimada = pd.Timestamp(year=año_estimado, month=int(mes_num), day=15)
-                df.loc[idx, "Fecha"] = fecha_estimada
-            except:
-                pass  # Si no se puede crear la fecha, dejar como está
-        
-        st.info(f"📅 Se crearon fechas estimadas (día 15) para {len(sin_fecha_con_mes)} registros sin fecha pero con mes válido, usando año {año_estimado}.")
-    
-    # Limpieza: eliminar solo por Monto nulo (ya no por Fecha porque creamos estimadas)
-    df_clean = df.dropna(subset=["Monto"])
-    rows_after_fecha_monto = len(df_clean)
+    # y marcarlos para poder incluirlos o excluirlos en los filtros
+    df["FechaEstimada"] = (df["Fecha"].isna() & df["MesNum"].notna()).to_numpy()
+    df["Fecha"], fechas_estimadas = estimate_missing_dates(df["Fecha"], df["MesNum"], año_estimado)
     
-    # Luego eliminar por MesNum nulo
-    df_final = df_clean.dropna(subset=["MesNum"])
+    # Limpieza: eliminar por Monto nulo (ya no por Fecha porque creamos estimadas) y por MesNum nulo
+    df_final = df.dropna(subset=["Monto", "MesNum"])
     rows_final = len(df_final)
     
-    # Calcular año después de limpiar
-    df_final["Año"] = df_final["Fecha"].dt.year
-    
-    # Análisis de qué pasó con cada mes
-    diagnostico_final = []
-    for mes_nombre in sorted(diagnostico_por_mes.index):
-        info = diagnostico_por_mes.loc[mes_nombre]
-        total_original = int(info["total"])
-        con_fecha = int(info["con_fecha"])
-        con_monto = int(info["con_monto"])
-        con_mesnum = int(info["con_mesnum"])
-        
-        # Contar cuántos quedaron después de limpiar
-        if con_mesnum > 0:
-            mes_num = df_diagnostico[df_diagnostico["Mes"] == mes_nombre]["MesNum"].iloc[0]
-            registros_finales = len(df_final[df_final["MesNum"] == mes_num])
-        else:
-            registros_finales = 0
-        
-        perdidos = total_original - registros_finales
-        
-        if perdidos > 0:
-            diagnostico_final.append({
-                "Mes": mes_nombre,
-                "Total Original": total_original,
-                "Con Fecha": con_fecha,
-                "Con Monto": con_monto,
-                "Mapeado": "Sí" if con_mesnum > 0 else "No",
-                "Registros Finales": registros_finales,
-                "Perdidos": perdidos
-            })
+    # Calcular año y llave de periodo (aaaamm) después de limpiar
+    df_final = df_final.assign(Año=df_final["Fecha"].dt.year)
+    df_final = df_final.assign(Periodo=period_key(df_final["Año"], df_final["MesNum"]))
+    df_final = apply_schema(df_final)
+    
+    # Registros finales por mes: se cruzan los conteos por MesNum con la tabla por etiqueta
+    finales_por_mesnum = df_final.groupby("MesNum").size()
+    diagnostico_por_mes["finales"] = (
+        diagnostico_por_mes["mes_num"].map(finales_por_mesnum).fillna(0).astype(int)
+    )
+    diagnostico_por_mes["perdidos"] = diagnostico_por_mes["total"] - diagnostico_por_mes["finales"]
+    con_perdidas = diagnostico_por_mes[diagnostico_por_mes["perdidos"] > 0]
+    perdidos_por_mes = [
+        {
+            "Mes": mes_nombre,
+            "Total Original": int(info["total"]),
+            "Con Fecha": int(info["con_fecha"]),
+            "Con Monto": int(info["con_monto"]),
+            "Mapeado": "Sí" if info["con_mesnum"] > 0 else "No",
+            "Registros Finales": int(info["finales"]),
+            "Perdidos": int(info["perdidos"]),
+        }
+        for mes_nombre, info in con_perdidas.iterrows()
+    ]
     
+    # Recontar exclusiones después de crear fechas estimadas
+    sin_fecha_final = int(df_final["Fecha"].isna().sum())
+    sin_monto_final = (rows_total - rows_final) - unmapped_count - sin_fecha_final
+    
+    razones_exclusion = []
+    if sin_fecha_final > 0:
+        razones_exclusion.append(f"{sin_fecha_final} por fecha faltante (sin mes válido)")
+    if sin_monto_final > 0:
+        razones_exclusion.append(f"{sin_monto_final} por monto faltante")
+    if unmapped_count > 0:
+        razones_exclusion.append(f"{unmapped_count} por mes no reconocido")
+
+    # Resumen compacto de la columna Mes del archivo original (reemplaza guardar la hoja completa)
+    por_etiqueta = diagnostico_por_mes[diagnostico_por_mes.index.str.lower() != 'nan']
+    por_etiqueta = por_etiqueta.groupby(por_etiqueta.index.str.capitalize(), sort=True).agg(
+        total=("total", "sum"),
+        mes_num=("mes_num", "first"),
+    )
+    conteo_mes_original = [
+        {
+            "Mes": mes_nombre,
+            "Registros": int(info["total"]),
+            "MesNum": None if pd.isna(info["mes_num"]) else int(info["mes_num"]),
+        }
+        for mes_nombre, info in por_etiqueta.iterrows()
+    ]
+
+    report = LoadReport(
+        rows_total=rows_total,
+        rows_final=rows_final,
+        unmapped_count=unmapped_count,
+        unmapped_months=[m for m in unmapped.index if m != 'nan'],
+        meses_unicos=list(diagnostico_por_mes.index),
+        fechas_estimadas=fechas_estimadas,
+        año_estimado=año_estimado,
+        perdidos_por_mes=perdidos_por_mes,
+        razones_exclusion=razones_exclusion,
+        conteo_mes_original=conteo_mes_original,
+    )
+    return df_final, report
+
+
+def render_load_diagnostics(report: Optional[LoadReport]) -> None:
+    """Muestra en Streamlit el diagnóstico generado durante la carga."""
+    if not report:
+        return
+
+    if report.unmapped_count > 0:
+        st.warning(f"⚠️ **{report.unmapped_count} registros** tienen meses no reconocidos y serán excluidos.")
+        st.write(f"**Valores de 'Mes' no reconocidos:** {report.unmapped_months}")
+        st.write(f"**Valores únicos en columna 'Mes' (todos):** {report.meses_unicos}")
+
+    if report.fechas_estimadas > 0:
+        st.info(f"📅 Se crearon fechas estimadas (día 15) para {report.fechas_estimadas} registros sin fecha pero con mes válido, usando año {report.año_estimado}.")
+
     # Mostrar diagnóstico detallado si hay pérdidas
-    if diagnostico_final:
+    if report.perdidos_por_mes:
         with st.expander("🔍 Diagnóstico detallado: Registros perdidos por mes", expanded=True):
-            df_diag = pd.DataFrame(diagnostico_final)
+            df_diag = pd.DataFrame(report.perdidos_por_mes)
             st.dataframe(df_diag, use_container_width=True)
             
             # Resumen
             st.write("**Resumen:**")
-            for row in diagnostico_final:
-                if row["Perdidos"] > 0:
-                    razones = []
-                    if row["Con Fecha"] < row["Total Original"]:
-                        razones.append(f"{row['Total Original'] - row['Con Fecha']} sin fecha")
-                    if row["Con Monto"] < row["Total Original"]:
-                        razones.append(f"{row['Total Original'] - row['Con Monto']} sin monto")
-                    if row["Mapeado"] == "No":
-                        razones.append("mes no mapeado")
-                    
-                    st.write(f"- **{row['Mes']}**: {row['Total Original']} originales → {row['Registros Finales']} finales (perdidos: {row['Perdidos']}) - Razones: {', '.join(razones) if razones else 'desconocidas'}")
-    
-    # Recontar exclusiones después de crear fechas estimadas
-    sin_fecha_final = df_final["Fecha"].isna().sum() if len(df_final) > 0 else 0
-    sin_monto_final = (rows_total - rows_final) - unmapped_count - sin_fecha_final
-    
+            for row in report.perdidos_por_mes:
+                razones = []
+                if row["Con Fecha"] < row["Total Original"]:
+                    razones.append(f"{row['Total Original'] - row['Con Fecha']} sin fecha")
+                if row["Con Monto"] < row["Total Original"]:
+                    razones.append(f"{row['Total Original'] - row['Con Monto']} sin monto")
+                if row["Mapeado"] == "No":
+                    razones.append("mes no mapeado")
+                
+                st.write(f"- **{row['Mes']}**: {row['Total Original']} originales → {row['Registros Finales']} finales (perdidos: {row['Perdidos']}) - Razones: {', '.join(razones) if razones else 'desconocidas'}")
+
     # Mostrar resumen de exclusiones
-    excluidos_total = rows_total - rows_final
-    if excluidos_total > 0:
-        razones = []
-        if sin_fecha_final > 0:
-            razones.append(f"{sin_fecha_final} por fecha faltante (sin mes válido)")
-        if sin_monto_final > 0:
-            razones.append(f"{sin_monto_final} por monto faltante")
-        if unmapped_count > 0:
-            razones.append(f"{unmapped_count} por mes no reconocido")
-        
+    if report.excluidos > 0:
+        razones = report.razones_exclusion
         st.info(
-            f"📊 Se cargaron **{rows_final} de {rows_total} registros**. "
-            f"**{excluidos_total} registros fueron excluidos:** {'; '.join(razones) if razones else 'por otras razones'}"
+            f"📊 Se cargaron **{report.rows_final} de {report.rows_total} registros**. "
+            f"**{report.excluidos} registros fueron excluidos:** {'; '.join(razones) if razones else 'por otras razones'}"
         )
-    
-    return df_final
 
 
-def ensure_data_loaded():
-    """Revisar si ya hay dataframe cargado en session_state."""
-    if "df" not in st.session_state:
+def export_snapshot(df: pd.DataFrame, diagnostico: Optional[LoadReport] = None, fmt: str = "parquet") -> bytes:
+    """
+    Exporta el dataset limpio como snapshot Parquet o Arrow IPC.
+
+    El snapshot se puede volver a cargar (archivo o URL) sin parsear el Excel
+    ni repetir la normalización.
+
+    Args:
+        df: DataFrame limpio (salida de load_data)
+        diagnostico: Diagnóstico de carga a incluir en el snapshot
+        fmt: "parquet" o "arrow"
+
+    Returns:
+        Bytes del snapshot
+    """
+    return write_snapshot(df, diagnostico=diagnostico.to_dict() if diagnostico else None, fmt=fmt)
+
+
+def ensure_data_loaded() -> pd.DataFrame:
+    """
+    Revisar si la sesión tiene un dataset cargado y devolverlo.
+
+    El DataFrame es compartido entre sesiones: las páginas no deben modificarlo.
+    """
+    df = get_session_df()
+    if df is None:
         st.error(
             "Primero carga el archivo de Urbanización en la página principal (Home)."
         )
         st.stop()
+    return df
+
+
+def _dataset_identity(df: pd.DataFrame) -> Optional[tuple]:
+    """Handle del dataset si df es el dataset de la sesión; None en otro caso."""
+    handle = st.session_state.get("dataset_handle")
+    if handle is not None and get_session_df() is df:
+        return handle
+    return None
 
 
 def apply_global_filters(df: pd.DataFrame) -> pd.DataFrame:
-    """Dibuja los filtros globales y devuelve el dataframe filtrado."""
+    """
+    Dibuja los filtros globales y devuelve el dataframe filtrado.
+
+    Los filtros se resuelven sobre el índice del dataset (ver filter_engine):
+    se combinan máscaras y se hace una sola selección de filas al final. Las
+    opciones y el resultado se memorizan por sesión con la llave (dataset,
+    valores de los filtros), de modo que las páginas comparten el mismo
+    DataFrame filtrado mientras los filtros no cambien. No se debe modificar.
+    """
+    index = get_filter_index(df)
+    cache = get_session_filter_cache()
+    options_cache = get_session_filter_cache("options", OPTIONS_CACHE_SIZE)
+    dataset = _dataset_identity(df)
+
+    def memo(*key):
+        # Sin identidad de dataset no se memoriza
+        return None if dataset is None else (dataset,) + key
+
+    def selection_mask(rows, selections):
+        mask = base_mask
+        for column, selected in selections:
+            if selected:
+                column_mask = index.isin(column, list(selected), rows)
+                mask = column_mask if mask is None else mask & column_mask
+        return mask
+
     with st.sidebar:
         st.markdown("### Filtros globales")
 
         # Año
-        years = sorted(df["Año"].dropna().unique())
+        years = index.years()
         if len(years) == 0:
             st.warning("No se encontraron años en los datos.")
+            st.session_state["global_filters"] = None
             return df
 
-        selected_year = st.selectbox("Año", years, index=len(years) - 1)
+        date_bounds = index.date_bounds()
+        period_modes = ["Año y meses", "Últimos meses", "Rango de periodos"]
+        if date_bounds is not None:
+            period_modes.append("Rango de fechas")
+        period_mode = st.radio("Periodo", period_modes)
 
-        df_year = df[df["Año"] == selected_year]
+        if period_mode == "Rango de fechas":
+            # Rango de fechas por día (puede cruzar de año); por defecto, el último año con datos
+            first_date, last_date = date_bounds
+            default_range = (max(first_date, last_date.replace(month=1, day=1)), last_date)
+            date_range = st.date_input(
+                "Rango de fechas",
+                value=default_range,
+                min_value=first_date,
+                max_value=last_date,
+            )
+            # Si se borra el campo, el widget devuelve una tupla vacía: se usa el rango por defecto
+            if len(date_range) == 0:
+                date_range = default_range
+            # Mientras se elige el rango, el widget devuelve una sola fecha
+            elif len(date_range) == 1:
+                date_range = (date_range[0], date_range[0])
+            date_range = tuple(date_range)
+            period_start = period_end = None
+            # La máscara ocupa un byte por fila del tramo: va en la caché de
+            # resultados (acotada en bytes), no con las listas de opciones
+            rows, base_mask = cache.get_or_compute(
+                memo("fechas", date_range),
+                lambda: index.date_rows(*date_range),
+            )
+        elif period_mode in ("Últimos meses", "Rango de periodos"):
+            # Periodos aaaamm que pueden cruzar de año (p. ej. 12 meses móviles)
+            date_range = None
+            periods = index.periods()
+            if period_mode == "Últimos meses":
+                max_months = (periods[-1] // 100 - periods[0] // 100) * 12 + periods[-1] % 100 - periods[0] % 100 + 1
+                trailing = st.number_input(
+                    "Meses",
+                    min_value=1,
+                    max_value=max_months,
+                    value=min(12, max_months),
+                    step=1,
+                    help="Ventana móvil que termina en el último mes con datos",
+                )
+                period_start, period_end = shift_period(periods[-1], -(int(trailing) - 1)), periods[-1]
+            else:
+                labels = period_labels(periods)
+                period_start, period_end = st.select_slider(
+                    "Rango de periodos",
+                    options=periods,
+                    value=(next(p for p in periods if p // 100 == periods[-1] // 100), periods[-1]),
+                    format_func=lambda p: labels[p],
+                )
+            rows = index.period_rows(period_start, period_end)
+            base_mask = None
+        else:
+            date_range = None
+            selected_year = st.selectbox("Año", years, index=len(years) - 1)
 
-        # Rango de meses
-        months_available = sorted(df_year["MesNum"].unique())
-        min_month, max_month = min(months_available), max(months_available)
+            rows = index.year_rows(selected_year)
 
-        month_labels = MONTH_NAMES.copy()
-        month_start, month_end = st.select_slider(
-            "Rango de meses",
-            options=months_available,
-            value=(min_month, max_month),
-            format_func=lambda m: month_labels.get(m, str(m)),
-        )
+            # Rango de meses
+            months_available = index.months(rows)
+            min_month, max_month = min(months_available), max(months_available)
 
-        filtered = df_year[
-            (df_year["MesNum"] >= month_start) & (df_year["MesNum"] <= month_end)
-        ]
+            month_labels = MONTH_NAMES.copy()
+            month_start, month_end = st.select_slider(
+                "Rango de meses",
+                options=months_available,
+                value=(min_month, max_month),
+                format_func=lambda m: month_labels.get(m, str(m)),
+            )
 
-        # Concepto Russildi
-        conceptos = sorted(filtered["Concepto Russildi"].dropna().unique())
-        selected_conceptos = st.multiselect(
-            "Concepto Russildi",
-            options=conceptos,
-            default=conceptos,
-        )
-        if selected_conceptos:
-            filtered = filtered[filtered["Concepto Russildi"].isin(selected_conceptos)]
-
-        # Categoría
-        categorias = sorted(filtered["Categoría"].dropna().unique())
-        selected_categorias = st.multiselect(
-            "Categoría",
-            options=categorias,
-            default=categorias,
-        )
-        if selected_categorias:
-            filtered = filtered[filtered["Categoría"].isin(selected_categorias)]
-
-        # Proveedor
-        proveedores = sorted(filtered["Proveedor"].dropna().unique())
-        selected_proveedores = st.multiselect(
-            "Proveedor",
-            options=proveedores,
-            default=proveedores,
-        )
-        if selected_proveedores:
-            filtered = filtered[filtered["Proveedor"].isin(selected_proveedores)]
+            period_start, period_end = selected_year * 100 + month_start, selected_year * 100 + month_end
+            rows = index.period_rows(period_start, period_end)
+            base_mask = None
+
+        # Fechas estimadas (día 15 del mes, para registros sin fecha)
+        include_estimated = True
+        if index.has_estimated:
+            include_estimated = st.checkbox(
+                "Incluir fechas estimadas (día 15)",
+                value=True,
+                help="Registros sin fecha en el archivo a los que se asignó el día 15 de su mes",
+            )
+            if not include_estimated:
+                estimated_mask = index.estimated_mask(rows)
+                base_mask = estimated_mask if base_mask is None else base_mask & estimated_mask
+
+        period = (period_start, period_end, date_range, include_estimated)
+
+        # Concepto Russildi, Categoría y Proveedor (cada lista depende de los filtros anteriores)
+        selections = ()
+        for column in DIMENSION_COLUMNS:
+            options = options_cache.get_or_compute(
+                memo("options", period, selections, column),
+                lambda: index.options(column, rows, selection_mask(rows, selections)),
+            )
+            selected = st.multiselect(
+                column,
+                options=options,
+                default=options,
+            )
+            selections += ((column, tuple(sorted(selected))),)
 
         # Umbral de monto
-        min_monto = float(filtered["Monto"].min())
-        max_monto = float(filtered["Monto"].max())
-        if min_monto == max_monto:
-            monto_range = (min_monto, max_monto)
+        bounds = options_cache.get_or_compute(
+            memo("monto", period, selections),
+            lambda: index.monto_bounds(rows, selection_mask(rows, selections)),
+        )
+        if bounds is None:
+            monto_range = None
+            full_monto_range = True
+        elif bounds[0] == bounds[1]:
+            monto_range = bounds
+            full_monto_range = True
         else:
-            monto_range = st.slider(
+            # Escalones por cuantiles y escala 1-2-5: usable de pesos a decenas de millones
+            steps = options_cache.get_or_compute(
+                memo("monto_steps", period, selections),
+                lambda: index.monto_steps(rows, selection_mask(rows, selections)),
+            )
+            monto_range = st.select_slider(
                 "Rango de monto por movimiento",
-                min_value=float(np.floor(min_monto)),
-                max_value=float(np.ceil(max_monto)),
-                value=(float(np.floor(min_monto)), float(np.ceil(max_monto))),
-                step=1.0,
+                options=steps,
+                value=(steps[0], steps[-1]),
+                format_func=format_monto_step,
             )
+            full_monto_range = tuple(monto_range) == (steps[0], steps[-1])
+
+    st.session_state["global_filters"] = GlobalFilters(
+        dataset=dataset,
+        period_start=period_start,
+        period_end=period_end,
+        selections=selections,
+        monto_range=monto_range,
+        full_monto_range=full_monto_range,
+        date_range=date_range,
+        include_estimated=include_estimated,
+    )
+
+    def compute():
+        mask = selection_mask(rows, selections)
+        if monto_range is not None:
+            monto_mask = index.monto_mask(rows, monto_range[0], monto_range[1])
+            mask = monto_mask if mask is None else mask & monto_mask
+        return index.take(rows, mask)
 
-        filtered = filtered[
-            (filtered["Monto"] >= monto_range[0])
-            & (filtered["Monto"] <= monto_range[1])
-        ]
+    return cache.get_or_compute(memo("frame", period, selections, monto_range), compute)
+
+
+def query_monto(filtered: pd.DataFrame, by=None, dropna: bool = True):
+    """
+    Agrega Monto del resultado de apply_global_filters.
+
+    Mientras el rango de Monto esté completo la consulta se responde desde el
+    cubo del dataset (ver cube.MontoCube), sin recorrer filas; en otro caso se
+    agregan las filas filtradas. Ambos resultados se memorizan por sesión.
+
+    Args:
+        filtered: DataFrame devuelto por apply_global_filters en este rerun
+        by: Columna o lista de columnas de agrupación; None para el total
+        dropna: False para conservar los grupos con llaves nulas
+
+    Returns:
+        Con by: DataFrame indexado por by con 'sum', 'count', 'min', 'max' y
+        'mean' de los montos no nulos (sin grupos vacíos; sin llaves nulas
+        salvo con dropna=False). Sin by: Serie con las mismas medidas.
+    """
+    by_key = tuple(by) if isinstance(by, list) else by
+    filters = st.session_state.get("global_filters")
+    df = get_session_df()
+    if can_use_cube(filters) and filters.dataset is not None and df is not None:
+        return get_session_filter_cache("options", OPTIONS_CACHE_SIZE).get_or_compute(
+            (filters, "cube", by_key, dropna),
+            lambda: get_monto_cube(df).query(filters, by, dropna=dropna),
+        )
+    return get_session_filter_cache().derived(
+        filtered, ("monto", by_key, dropna), lambda: aggregate_rows(filtered, by, dropna=dropna)
+    )
+
+
+def clean_filtered(filtered: pd.DataFrame, required_columns: list = None) -> pd.DataFrame:
+    """
+    Variante de un resultado de apply_global_filters con Monto numérico y sin
+    nulos en las columnas requeridas. Se memoriza junto con el resultado.
+
+    Args:
+        filtered: DataFrame devuelto por apply_global_filters
+        required_columns: Columnas que no pueden ser nulas (por defecto ["Monto"])
+    """
+    required_columns = tuple(required_columns or ["Monto"])
 
-    return filtered
+    def compute():
+        clean = filtered.assign(Monto=pd.to_numeric(filtered["Monto"], errors="coerce"))
+        return clean.dropna(subset=list(required_columns))
+
+    return get_session_filter_cache().derived(filtered, ("clean", required_columns), compute)
+
+
+def sort_keys(values: pd.Series, ascending: bool = True) -> np.ndarray:
+    """
+    Llaves numéricas para ordenar una columna con page_positions.
+
+    Los números y fechas se usan tal cual (fechas como int64) y el texto por
+    su rango alfabético. Para orden descendente la llave se niega; los nulos
+    quedan siempre al final.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        keys = values.to_numpy(dtype="datetime64[ns]").view("int64").copy()
+        missing = keys == np.iinfo(np.int64).min
+    elif pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+        keys = values.to_numpy(dtype="float64", na_value=np.nan)
+        return keys if ascending else -keys
+    else:
+        keys = pd.factorize(values, sort=True)[0].astype("int64")
+        missing = keys < 0
+    if not ascending:
+        keys = -keys
+    keys[missing] = np.iinfo(np.int64).max
+    return keys
+
+
+def page_positions(keys: np.ndarray, start: int, stop: int) -> np.ndarray:
+    """
+    Posiciones de las filas start..stop-1 en el orden de las llaves.
+
+    Solo se ordenan las filas que pueden caer en la página: una partición
+    (O(n)) encuentra la llave de la fila stop-1 y se ordenan las filas con
+    llave menor o igual. Los empates se resuelven por posición, de modo que
+    las páginas no se traslapan y equivalen a un ordenamiento estable completo.
+    """
+    stop = min(stop, len(keys))
+    if start >= stop:
+        return np.empty(0, dtype="int64")
+    kth = np.partition(keys, stop - 1)[stop - 1]
+    if isinstance(kth, float) and np.isnan(kth):
+        candidates = np.arange(len(keys))
+    else:
+        candidates = np.flatnonzero(keys <= kth)
+    order = candidates[np.argsort(keys[candidates], kind="stable")]
+    return order[start:stop]
 
 
 def format_millions(value: float) -> str:
@@ -443,6 +1040,13 @@ def format_millions(value: float) -> str:
     return f"${value/1_000_000:,.2f} M"
 
 
+def format_monto_step(value: float) -> str:
+    """Etiqueta corta de un monto para sliders ($1,500 / $2.50 M)."""
+    if abs(value) >= 1_000_000:
+        return format_millions(value)
+    return f"${value:,.0f}"
+
+
 def format_currency(value: float) -> str:
     """Formatea un valor numérico en formato de moneda con $, comas y 2 decimales."""
     if pd.isna(value):
@@ -450,33 +1054,126 @@ def format_currency(value: float) -> str:
     return f"${value:,.2f}"
 
 
-def generate_narrative(df: pd.DataFrame, gasto_por_mes: pd.Series, total_ytd: float, 
-                       meses_unicos: list, year: int, MONTH_NAMES: dict, 
-                       format_millions: callable, prom_ultimos3: float = None, 
-                       prom_resto: float = None, delta_pct: float = None) -> str:
+def _round_cents(montos: np.ndarray) -> np.ndarray:
+    """
+    Centavos de montos no negativos redondeados como el formato "%.2f": al
+    más cercano según el valor binario exacto, con empates exactos a par.
+
+    montos * 100 se calcula con su error de redondeo (producto exacto de
+    Dekker): cuando el producto cae justo en .5, el signo del error indica
+    de qué lado está el valor exacto.
+    """
+    product = montos * 100
+    split = montos * 134217729.0  # 2**27 + 1
+    high = split - (split - montos)
+    low = montos - high
+    error = (high * 100 - product) + low * 100
+    cents = np.round(product)
+    tie = product - np.floor(product) == 0.5
+    cents = np.where(tie & (error > 0), np.ceil(product), cents)
+    cents = np.where(tie & (error < 0), np.floor(product), cents)
+    return cents.astype("int64")
+
+
+def format_currency_values(values) -> np.ndarray:
+    """
+    Versión vectorizada de format_currency para columnas completas (p. ej.
+    texto exportado), sin un ciclo de Python por celda.
+
+    Los caracteres se escriben con aritmética entera en una matriz de bytes
+    (una fila por monto, alineada a la derecha): centavos, punto, dígitos de
+    los pesos con comas cada tres y el prefijo "$" o "$-".
+
+    Args:
+        values: Montos (arreglo o Serie numérica; los nulos se muestran como $0.00)
+
+    Returns:
+        Arreglo de strings con el mismo formato que format_currency
+
+    Los empates de medio centavo se redondean como f"{x:,.2f}" (sobre el
+    valor binario exacto), igual que format_currency:
+
+    >>> empates = [0.005, 2.675, 1.005, 0.125, 0.375, 99.995, -0.005, -0.0]
+    >>> format_currency_values(empates).tolist()
+    ['$0.01', '$2.67', '$1.00', '$0.12', '$0.38', '$100.00', '$-0.01', '$-0.00']
+    >>> format_currency_values(empates).tolist() == [format_currency(x) for x in empates]
+    True
+    """
+    montos = pd.to_numeric(pd.Series(values), errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+    montos = np.where(np.isnan(montos), 0.0, montos)
+    cents = _round_cents(np.abs(montos))
+    pesos, centavos = np.divmod(cents, 100)
+    if len(pesos) == 0:
+        return np.array([], dtype=str)
+
+    n_digits = np.ones(len(pesos), dtype="int64")
+    while (pesos >= 10 ** n_digits).any():
+        n_digits[pesos >= 10 ** n_digits] += 1
+    max_digits = int(n_digits.max())
+    width = 2 + max_digits + (max_digits - 1) // 3 + 3
+
+    buf = np.full((len(pesos), width), ord(" "), dtype="uint8")
+    buf[:, -1] = ord("0") + centavos % 10
+    buf[:, -2] = ord("0") + centavos // 10
+    buf[:, -3] = ord(".")
+    col, rest = width - 4, pesos.copy()
+    for digit in range(max_digits):
+        active = digit < n_digits
+        if digit > 0 and digit % 3 == 0:
+            buf[active, col] = ord(",")
+            col -= 1
+        buf[active, col] = ord("0") + rest[active] % 10
+        rest //= 10
+        col -= 1
+
+    rows = np.arange(len(pesos))
+    prefix = width - 4 - n_digits - (n_digits - 1) // 3
+    # signbit: -0.0 se muestra como "$-0.00", igual que format_currency
+    negative = np.signbit(montos)
+    buf[rows, prefix] = np.where(negative, ord("-"), ord("$"))
+    buf[rows[negative], prefix[negative] - 1] = ord("$")
+    return np.char.lstrip(buf.view(f"S{width}").ravel()).astype(str)
+
+
+def currency_column_config(currency_columns: list, percent_columns: list = None) -> dict:
+    """
+    column_config para st.dataframe que muestra montos como moneda ($1,234.57)
+    y porcentajes (valores 0-100) con dos decimales, sin convertir las
+    columnas a texto: siguen siendo numéricas y se ordenan como números.
+    """
+    config = {col: st.column_config.NumberColumn(col, format="dollar") for col in currency_columns}
+    for col in percent_columns or []:
+        config[col] = st.column_config.NumberColumn(col, format="%.2f%%")
+    return config
+
+
+def generate_narrative(metrics) -> str:
     """
     Genera una narrativa automática y dinámica basada en los datos filtrados.
     Se actualiza automáticamente cuando cambian los filtros.
     
     Args:
-        df: DataFrame filtrado con los datos
-        gasto_por_mes: Serie con gasto por mes
-        total_ytd: Total acumulado del periodo
-        meses_unicos: Lista de meses únicos en el periodo
-        year: Año del periodo
-        MONTH_NAMES: Diccionario de nombres de meses
-        format_millions: Función para formatear millones
-        prom_ultimos3: Promedio de últimos 3 meses (opcional)
-        prom_resto: Promedio del resto de meses (opcional)
-        delta_pct: Porcentaje de cambio (opcional)
+        metrics: Métricas del resultado filtrado (analytics.MetricsBundle); la
+            narrativa solo lee de ellas, sin volver a recorrer las filas
     
     Returns:
         String con la narrativa generada
     """
+    gasto_por_mes = metrics.monthly
+    total_ytd = metrics.total
+    meses_unicos = metrics.periods
+    year = metrics.year
+    MONTH_NAMES = metrics.labels
+    recent = metrics.recent
+    prom_ultimos3 = recent["promedio"] if recent else None
+    prom_resto = recent["promedio_resto"] if recent else None
+    delta_pct = recent["delta_pct"] if recent else None
+
     # Información básica del periodo
     mes_inicio = MONTH_NAMES.get(meses_unicos[0], str(meses_unicos[0]))
     mes_fin = MONTH_NAMES.get(meses_unicos[-1], str(meses_unicos[-1]))
     meses_count = len(meses_unicos)
+    periodo_txt = f"**{mes_inicio}** y **{mes_fin}** de **{year}**" if year is not None else f"**{mes_inicio}** y **{mes_fin}**"
     
     # Análisis de gasto por mes
     mes_max = gasto_por_mes.idxmax()
@@ -510,32 +1207,27 @@ def generate_narrative(df: pd.DataFrame, gasto_por_mes: pd.Series, total_ytd: fl
         tendencia_pct = 0
         tendencia_reciente = 0
     
-    # Análisis por conceptos (si está disponible)
+    # Análisis por conceptos
     conceptos_info = ""
-    if "Concepto Russildi" in df.columns:
-        conceptos = df.groupby("Concepto Russildi")["Monto"].sum().sort_values(ascending=False)
-        if len(conceptos) > 0:
-            top_concepto = conceptos.index[0]
-            top_concepto_monto = conceptos.iloc[0]
-            top_concepto_pct = (top_concepto_monto / total_ytd * 100) if total_ytd > 0 else 0
-            conceptos_info = f" El concepto que más consume recursos es **{top_concepto}** con {format_millions(top_concepto_monto)} ({top_concepto_pct:.1f}% del total)."
-    
-    # Análisis por proveedores (si está disponible)
+    conceptos = metrics.ranking("Concepto Russildi")
+    if len(conceptos) > 0:
+        top_concepto = conceptos.index[0]
+        top_concepto_monto = conceptos.iloc[0]
+        top_concepto_pct = (top_concepto_monto / total_ytd * 100) if total_ytd > 0 else 0
+        conceptos_info = f" El concepto que más consume recursos es **{top_concepto}** con {format_millions(top_concepto_monto)} ({top_concepto_pct:.1f}% del total)."
+    
+    # Análisis por proveedores
     proveedores_info = ""
-    if "Proveedor" in df.columns:
-        proveedores = df.groupby("Proveedor")["Monto"].sum().sort_values(ascending=False)
-        if len(proveedores) > 0:
-            num_proveedores = len(proveedores)
-            top3_proveedores = proveedores.head(3).sum()
-            top3_pct = (top3_proveedores / total_ytd * 100) if total_ytd > 0 else 0
-            if top3_pct > 50:
-                proveedores_info = f" Se observa una alta concentración de proveedores: los 3 principales concentran el {top3_pct:.1f}% del gasto total."
+    if len(metrics.ranking("Proveedor")) > 0:
+        top3_pct = metrics.top_share("Proveedor", 3) if total_ytd > 0 else 0
+        if top3_pct > 50:
+            proveedores_info = f" Se observa una alta concentración de proveedores: los 3 principales concentran el {top3_pct:.1f}% del gasto total."
     
     # Construir narrativa
     narrativa = f"""
 ### Resumen Ejecutivo
 
-Entre **{mes_inicio}** y **{mes_fin}** de **{year}** se han ejercido **{format_millions(total_ytd)}** en urbanización, 
+Entre {periodo_txt} se han ejercido **{format_millions(total_ytd)}** en urbanización, 
 distribuidos a lo largo de **{meses_count} meses** con un promedio mensual de **{format_millions(promedio_mensual)}**.
 
 ### Análisis de Variabilidad
@@ -609,7 +1301,9 @@ es de **{format_millions(gasto_max - gasto_min)}** ({((gasto_max / gasto_min - 1
 
 def format_dataframe_currency(df: pd.DataFrame, currency_columns: list = None) -> pd.DataFrame:
     """
-    Formatea columnas de moneda en un DataFrame para visualización.
+    Formatea columnas de moneda en un DataFrame como texto (p. ej. para
+    exportar). Para mostrar tablas usa currency_column_config, que conserva
+    las columnas numéricas.
     
     Args:
         df: DataFrame a formatear
@@ -618,86 +1312,60 @@ def format_dataframe_currency(df: pd.DataFrame, currency_columns: list = None) -
     Returns:
         DataFrame con columnas de moneda formateadas como strings
     """
-    df_formatted = df.copy()
-    
     if currency_columns is None:
         currency_columns = ['Monto'] if 'Monto' in df.columns else []
-    
-    for col in currency_columns:
-        if col in df_formatted.columns:
-            df_formatted[col] = df_formatted[col].apply(
-                lambda x: format_currency(x) if pd.notna(x) else "$0.00"
-            )
-    
-    return df_formatted
+
+    return df.assign(**{
+        col: format_currency_values(df[col]) for col in currency_columns if col in df.columns
+    })
 
 
 def prepare_monthly_chart_data(data: pd.Series, include_all_months: bool = False) -> pd.DataFrame:
     """
-    Prepara datos mensuales para gráficos asegurando orden cronológico (Enero a Diciembre).
+    Prepara datos mensuales para gráficos asegurando orden cronológico.
     
     Args:
-        data: Serie de pandas con MesNum como índice y valores numéricos
-        include_all_months: Si True, incluye todos los meses del 1 al 12 (rellenando con 0)
+        data: Serie de pandas con MesNum (1-12) o Periodo (aaaamm) como índice y valores numéricos
+        include_all_months: Si True, rellena con 0 los meses sin datos (del 1 al 12 con
+            MesNum; todos los periodos entre el primero y el último con Periodo)
     
     Returns:
         DataFrame con columnas 'Mes' y 'Valor', ordenado cronológicamente
+        (ver period_labels para las etiquetas)
     """
-    # Si include_all_months, crear serie completa del 1 al 12
-    if include_all_months:
-        all_months = pd.Series(0.0, index=range(1, 13), dtype=float)
-        all_months.update(data)
-        data = all_months
-    
-    # Asegurar que esté ordenado por número de mes
     data = data.sort_index()
-    
-    # Crear orden de meses cronológico (1=Enero, 2=Febrero, ..., 12=Diciembre)
-    month_order = [MONTH_NAMES[i] for i in range(1, 13)]
-    
-    # Crear diccionario con mes_nombre -> valor, solo para meses que tienen datos
-    result_dict = {}
-    for mes_num in sorted(data.index):
-        mes_nombre = MONTH_NAMES.get(mes_num, str(mes_num))
-        result_dict[mes_nombre] = data.loc[mes_num]
-    
-    # Crear lista de datos en orden cronológico estricto
-    ordered_data = []
-    ordered_meses = []
-    for mes_nombre in month_order:
-        if mes_nombre in result_dict:
-            ordered_meses.append(mes_nombre)
-            ordered_data.append(result_dict[mes_nombre])
-    
-    # Crear DataFrame con columna Mes y Valor
-    df_result = pd.DataFrame({
-        'Mes': ordered_meses,
-        'Valor': ordered_data
+    if include_all_months:
+        if len(data) > 0 and data.index.max() > 12:
+            full_index = period_range(data.index.min(), data.index.max())
+        else:
+            full_index = range(1, 13)
+        data = data.reindex(full_index, fill_value=0.0)
+
+    labels = period_labels(data.index)
+    return pd.DataFrame({
+        'Mes': data.index.map(labels).to_numpy(dtype=object),
+        'Valor': data.to_numpy(dtype=float),
     })
-    
-    return df_result
 
 
-def create_monthly_bar_chart(data: pd.Series, title: str = "Gasto mensual", 
-                             value_column: str = "Gasto", include_all_months: bool = False) -> alt.Chart:
-    """
-    Crea un gráfico de barras mensual con orden cronológico garantizado usando Altair.
-    
-    Args:
-        data: Serie de pandas con MesNum como índice y valores numéricos
-        title: Título del gráfico
-        value_column: Nombre de la columna de valores
-        include_all_months: Si True, incluye todos los meses del 1 al 12 (rellenando con 0)
-    
-    Returns:
-        Chart de Altair
-    """
+def period_range(period_start: int, period_end: int) -> list:
+    """Todos los periodos aaaamm entre period_start y period_end (inclusive)."""
+    start, end = divmod(int(period_start), 100), divmod(int(period_end), 100)
+    months = np.arange(start[0] * 12 + start[1] - 1, end[0] * 12 + end[1])
+    return ((months // 12) * 100 + months % 12 + 1).tolist()
+
+
+def _monthly_chart(data: pd.Series, mark: str, title: str, value_column: str,
+                   include_all_months: bool) -> alt.Chart:
+    """Gráfico mensual de Altair (barras o líneas) con orden cronológico explícito."""
     df = prepare_monthly_chart_data(data, include_all_months=include_all_months)
     
-    # Definir orden de meses para Altair
-    month_order = [MONTH_NAMES[i] for i in range(1, 13)]
-    
-    chart = alt.Chart(df).mark_bar().encode(
+    # Orden cronológico explícito para Altair
+    month_order = df['Mes'].tolist()
+
+    base = alt.Chart(df)
+    base = base.mark_bar() if mark == "bar" else base.mark_line(point=True)
+    return base.encode(
         x=alt.X('Mes:O', 
                 title='Mes',
                 sort=month_order,  # Orden explícito
@@ -711,8 +1379,23 @@ def create_monthly_bar_chart(data: pd.Series, title: str = "Gasto mensual",
         width=600,
         height=400
     )
+
+
+def create_monthly_bar_chart(data: pd.Series, title: str = "Gasto mensual", 
+                             value_column: str = "Gasto", include_all_months: bool = False) -> alt.Chart:
+    """
+    Crea un gráfico de barras mensual con orden cronológico garantizado usando Altair.
     
-    return chart
+    Args:
+        data: Serie de pandas con MesNum o Periodo (aaaamm) como índice y valores numéricos
+        title: Título del gráfico
+        value_column: Nombre de la columna de valores
+        include_all_months: Si True, rellena con 0 los meses sin datos (ver prepare_monthly_chart_data)
+    
+    Returns:
+        Chart de Altair
+    """
+    return _monthly_chart(data, "bar", title, value_column, include_all_months)
 
 
 def create_monthly_line_chart(data: pd.Series, title: str = "Gasto acumulado",
@@ -721,32 +1404,58 @@ def create_monthly_line_chart(data: pd.Series, title: str = "Gasto acumulado",
     Crea un gráfico de líneas mensual con orden cronológico garantizado usando Altair.
     
     Args:
-        data: Serie de pandas con MesNum como índice y valores numéricos
+        data: Serie de pandas con MesNum o Periodo (aaaamm) como índice y valores numéricos
         title: Título del gráfico
         value_column: Nombre de la columna de valores
-        include_all_months: Si True, incluye todos los meses del 1 al 12 (rellenando con 0)
+        include_all_months: Si True, rellena con 0 los meses sin datos (ver prepare_monthly_chart_data)
     
     Returns:
         Chart de Altair
     """
-    df = prepare_monthly_chart_data(data, include_all_months=include_all_months)
-    
-    # Definir orden de meses para Altair
-    month_order = [MONTH_NAMES[i] for i in range(1, 13)]
-    
-    chart = alt.Chart(df).mark_line(point=True).encode(
-        x=alt.X('Mes:O',
-                title='Mes',
-                sort=month_order,  # Orden explícito
-                axis=alt.Axis(labelAngle=-45)),
-        y=alt.Y('Valor:Q',
-                title=value_column,
-                axis=alt.Axis(format='$,.0f')),
-        tooltip=['Mes', alt.Tooltip('Valor:Q', format='$,.2f')]
-    ).properties(
-        title=title,
-        width=600,
-        height=400
-    )
-    
-    return chart
\ No newline at end of file
+    return _monthly_chart(data, "line", title, value_column, include_all_months)
+
+
+# Specs de gráficos mensuales memorizados (compartidos entre sesiones)
+CHART_CACHE_SIZE = 64
+
+
+def _series_digest(data: pd.Series) -> str:
+    """Huella del índice y los valores de una serie, para usarla como llave de caché."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(data.index.to_numpy(dtype="int64").tobytes())
+    digest.update(data.to_numpy(dtype="float64").tobytes())
+    return digest.hexdigest()
+
+
+@st.cache_resource(max_entries=CHART_CACHE_SIZE, show_spinner=False)
+def _cached_chart_spec(mark: str, digest: str, title: str, value_column: str,
+                       include_all_months: bool, _data: pd.Series) -> dict:
+    # La serie no se hashea (el guion bajo la excluye de la llave): la
+    # identifica su huella
+    spec = _monthly_chart(_data, mark, title, value_column, include_all_months).to_dict()
+    # Sin la configuración del tema por defecto de Altair (Streamlit aplica el suyo)
+    spec.pop("config", None)
+    return spec
+
+
+def monthly_chart_spec(data: pd.Series, mark: str = "bar", title: str = "Gasto mensual",
+                       value_column: str = "Gasto", include_all_months: bool = False) -> dict:
+    """
+    Spec Vega-Lite de un gráfico mensual, memorizado por la huella de la serie
+    y los parámetros del gráfico.
+
+    Los reruns con la misma serie reutilizan el spec ya generado en lugar de
+    volver a construir y validar el gráfico de Altair. Se muestra con
+    st.vega_lite_chart(spec=...); el spec es compartido y no debe modificarse.
+
+    Args:
+        data: Serie de pandas con MesNum o Periodo (aaaamm) como índice y valores numéricos
+        mark: "bar" (create_monthly_bar_chart) o "line" (create_monthly_line_chart)
+        title: Título del gráfico
+        value_column: Nombre de la columna de valores
+        include_all_months: Si True, rellena con 0 los meses sin datos (ver prepare_monthly_chart_data)
+
+    Returns:
+        Diccionario con el spec Vega-Lite (datos incluidos)
+    """
+    return _cached_chart_spec(mark, _series_digest(data), title, value_column, include_all_months, data)